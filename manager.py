@@ -2,40 +2,2914 @@
 # Date completed: 14-Dec-2024
 # License: Feel free to use it's all yours
 # ____________________________________________________________________________________________________
-import random
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from collections import Counter
 import csv
 import os
 import time
+import sys
+import argparse
+import shlex
+import sqlite3
+import re
+import bisect
+import heapq
+import math
+import operator
+import gzip
+import zlib
+import io
+import asyncio
+import urllib.parse
+import random
+import tempfile
+import shutil
+import platform
+import tracemalloc
+import cProfile
+import pstats
+import atexit
+import mmap
+import struct
+from array import array
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Fast JSON when it is installed: orjson, else ujson, else the json module.
+# Their decode errors are all ValueErrors. orjson indents by 2 instead of 3.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# TASKS_COMPACT=1 saves tasks.json without indents and spaces, which makes it
+# about a third smaller and much quicker to write (the json module can only
+# indent in pure Python)
+COMPACT_JSON = os.environ.get('TASKS_COMPACT') == '1'
+
+# str or bytes -> Python objects
+def json_loads(data):
+    if orjson:
+        return orjson.loads(data)
+    if ujson:
+        return ujson.loads(data)
+    return json.loads(data)
+
+# default=dict turns Task objects back into plain dicts
+def json_dumps(obj, pretty=False):
+    if orjson:
+        return orjson.dumps(obj, default=dict, option=orjson.OPT_INDENT_2 if pretty else 0).decode()
+    if ujson:
+        return ujson.dumps(obj, default=dict, indent=3 if pretty else 0, ensure_ascii=False, escape_forward_slashes=False)
+    return json.dumps(obj, default=dict, indent=3 if pretty else None)
+
+def json_dump(obj, f, pretty=False):
+    if orjson or ujson:
+        f.write(json_dumps(obj, pretty))
+    elif pretty:
+        json.dump(obj, f, default=dict, indent=3)
+    else:
+        json.dump(obj, f, default=dict, separators=(',', ':'))
+
+# The items of a JSON array file one at a time, reading STREAM_CHUNK characters
+# at once, so only one chunk and one item are in memory instead of the whole
+# file and list. Always the json module, the others can't parse part of a text.
+STREAM_CHUNK = 1 << 20
+BETWEEN_ITEMS = re.compile(r'[\s,]*')
+
+def iter_json_array(f):
+    decoder = json.JSONDecoder()
+    text = f.read(STREAM_CHUNK).lstrip()
+    if not text:
+        return
+    if text[0] != '[':
+        raise ValueError('Expected a JSON array')
+    pos = 1
+    while True:
+        pos = BETWEEN_ITEMS.match(text, pos).end()
+        if pos < len(text) and text[pos] == ']':
+            return
+        try:
+            item, pos = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            # The item goes on in the next chunk
+            more = f.read(STREAM_CHUNK)
+            if not more:
+                raise
+            text = text[pos:] + more
+            pos = 0
+            continue
+        yield item
+
+TASKS_FILE = 'tasks.json'
+
+def load_task(path=TASKS_FILE):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    if metrics:
+        metrics.count(f'{os.path.basename(path)} bytes read', len(data))
+    return json_loads(data)
+
+def save_task(tasks, path=TASKS_FILE):
+    # Write to a temp file first so a crash never leaves a half written tasks.json
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json_dump(tasks, f, pretty=not COMPACT_JSON)
+        f.flush()
+        os.fsync(f.fileno())
+        if metrics:
+            metrics.count(f'{os.path.basename(path)} bytes written', f.tell())
+    os.replace(temp_path, path)
+
+PRIORITIES = ('high', 'medium', 'low')
+TASK_KEYS = ('id', 'title', 'priority', 'due date', 'done', 'description', 'tag', 'version')
+
+# 'Study, work,study' -> ('study', 'work'). The tag field holds several tags
+# separated by commas, each tag is interned so tasks share one string per tag.
+def split_tags(text):
+    tags = (tag.strip().lower() for tag in text.split(','))
+    return tuple(dict.fromkeys(sys.intern(tag) for tag in tags if tag))
+
+def join_tags(tags):
+    return ', '.join(tags)
+
+# One task in memory. A dict with seven string keys costs a few hundred bytes
+# per task, this keeps the same data in fixed slots: priority as a number
+# (0 = high, 1 = medium, 2 = low), the due date as a day number and the tags
+# as a tuple (see split_tags). version goes up by one on every change, see
+# TaskStore.update().
+# t['due date'], t.get('tag'), dict(t) etc. still work like on the old dicts,
+# so the screens don't care which one they get. Keys tasks.json has that we
+# don't know about are kept in extra.
+class Task:
+    __slots__ = ('id', 'title', 'rank', 'due', 'done', 'description', 'tags', 'version', 'extra')
+
+    def __init__(self, task):
+        self.extra = None
+        self.version = 0
+        for key, value in task.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key == 'priority':
+            return PRIORITIES[self.rank]
+        if key == 'due date':
+            day = date.fromordinal(self.due)
+            return f'{day.year:04d}/{day.month:02d}/{day.day:02d}'
+        if key == 'tag':
+            return join_tags(self.tags)
+        if key in TASK_KEYS:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'priority':
+            self.rank = PRIORITIES.index(value)
+        elif key == 'due date':
+            self.due = due_ordinal(value)
+        elif key == 'tag':
+            self.tags = split_tags(value)
+        elif key in TASK_KEYS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return key in TASK_KEYS or bool(self.extra and key in self.extra)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def update(self, fields):
+        for key, value in fields.items():
+            self[key] = value
+
+    # Same keys and order as tasks.json, so dict(task) gives the saved form
+    def keys(self):
+        return TASK_KEYS + tuple(self.extra or ())
+
+# Fold the journal back into tasks.json after this many changes
+COMPACT_EVERY = 1000
+
+def journal_path(path):
+    return os.path.splitext(path)[0] + '.journal'
+
+# Returns the journal entries after offset and where they end. A last line
+# that is only half written is skipped, with repair=True (only while holding
+# the store's lock) it is cut off, so new entries start on a clean line.
+def read_journal(path, offset=0, repair=False):
+    entries = []
+    good_size = offset
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entries.append(json_loads(line))
+                except ValueError:
+                    break
+                good_size += len(line)
+    except FileNotFoundError:
+        return entries, 0
+    if repair and os.path.getsize(path) > good_size:
+        with open(path, 'r+b') as f:
+            f.truncate(good_size)
+    if metrics:
+        metrics.count('journal bytes read', good_size - offset)
+        metrics.count('journal records read', len(entries))
+    return entries, good_size
+
+# Tells whether a file was replaced, os.replace() always gives a new inode
+def file_state(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+# Advisory lock on a file next to the store, held only while a change is
+# written. Several sessions can read at the same time without it.
+# Taking it again in the same session (add inside add_many) just nests.
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.depth = 0
+
+    def __enter__(self):
+        if self.depth == 0:
+            self.file = open(self.path, 'a+b')
+            if fcntl:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            else:
+                self.file.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:  # LK_LOCK gives up after 10 seconds
+                        pass
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if self.depth == 0:
+            if fcntl:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+            self.file.close()
+            self.file = None
+
+# A change that would overwrite what another session changed in the meantime
+class ConflictError(ValueError):
+    pass
+
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+# word -> weight in one task, a word in the title counts twice
+def text_weights(task):
+    weights = Counter()
+    for word in tokenize(task['title']):
+        weights[word] += 2
+    for word in tokenize(task['description']):
+        weights[word] += 1
+    return weights
+
+# Inverted index over title and description words for search_task().
+# postings maps word -> {task id: weight}, a word in the title counts twice.
+# words is kept sorted so a partial word can find every word starting with it.
+class TextIndex:
+    fields = ('title', 'description')
+
+    def __init__(self, tasks=()):
+        self.postings = {}
+        self.doc_words = {}
+        for t in tasks:
+            self.index(t)
+        self.words = sorted(self.postings)
+
+    def index(self, task):
+        weights = text_weights(task)
+        self.doc_words[task['id']] = weights
+        new_words = []
+        for word, weight in weights.items():
+            if word not in self.postings:
+                self.postings[word] = {}
+                new_words.append(word)
+            self.postings[word][task['id']] = weight
+        return new_words
+
+    def add(self, task):
+        for word in self.index(task):
+            bisect.insort(self.words, word)
+
+    def remove(self, task):
+        task_id = task['id']
+        for word in self.doc_words.pop(task_id, ()):
+            docs = self.postings[word]
+            del docs[task_id]
+            if not docs:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+
+    def words_starting_with(self, prefix):
+        start = bisect.bisect_left(self.words, prefix)
+        end = bisect.bisect_left(self.words, prefix + '\U0010ffff')
+        return self.words[start:end]
+
+    # How much one occurrence of word is worth when matching term
+    def word_factors(self, term, words):
+        total = len(self.doc_words)
+        return {word: math.log(1 + total / len(self.postings[word])) * (1 if word == term else 0.5)
+                for word in words}
+
+    # Most tasks text can match: how many have the rarest of its words
+    def estimate(self, text):
+        return min((sum(len(self.postings[word]) for word in self.words_starting_with(term))
+                    for term in set(tokenize(text))), default=0)
+
+    # Every word of the query must match a word of the task, either fully or as
+    # the start of it. Scores add up weight * idf, partial matches count half.
+    # Candidates come from the rarest query word (or among, when the caller
+    # already has fewer), the other words are only checked against those.
+    def search(self, text, limit=None, among=None):
+        matches = {term: self.words_starting_with(term) for term in set(tokenize(text))}
+        if not matches:
+            return []
+        size = lambda term: sum(len(self.postings[word]) for word in matches[term])
+        terms = sorted(matches, key=size)
+
+        if among is None:
+            scores = {}
+            factors = self.word_factors(terms[0], matches[terms[0]])
+            for word, factor in factors.items():
+                for task_id, weight in self.postings[word].items():
+                    scores[task_id] = scores.get(task_id, 0) + weight * factor
+            terms = terms[1:]
+        else:
+            scores = dict.fromkeys(among, 0)
+
+        for term in terms:
+            factors = self.word_factors(term, matches[term])
+            narrowed = {}
+            for task_id, score in scores.items():
+                extra = 0
+                for word, weight in self.doc_words[task_id].items():
+                    if word in factors:
+                        extra += weight * factors[word]
+                if extra:
+                    narrowed[task_id] = score + extra
+            scores = narrowed
+
+        if limit is None:
+            return sorted(scores, key=scores.get, reverse=True)
+        return heapq.nlargest(limit, scores, key=scores.get)
+
+# TextIndex.search() in one pass over tasks, without an index: the tasks
+# matching every word (and the checks) are kept, and how many of all tasks
+# have each word starting with a query word is counted for the scores.
+# Gives the same scores as the index, the best matches first.
+# A list of tasks that is big enough is searched in parts by worker processes
+# (see parallel_parts()), the counts of the parts add up to the same scores.
+def scan_search(tasks, text, checks=(), limit=None):
+    terms = set(tokenize(text))
+    if not terms:
+        return []
+    if isinstance(tasks, list) and use_parallel(len(tasks)):
+        total = 0
+        counts = Counter()
+        found = []
+        for part_total, part_counts, part_found in parallel_parts(tasks, search_slice, terms, checks):
+            total += part_total
+            counts.update(part_counts)
+            found += [(tasks[i], matching) for i, matching in part_found]
+    else:
+        total, counts, found = search_part(tasks, terms, checks)
+        found = [(task, matching) for i, task, matching in found]
+    scores = []
+    for task, matching in found:
+        score = sum(weight * math.log(1 + total / counts[word]) * (1 if word == term else 0.5)
+                    for term in terms for word, weight in matching.items() if word.startswith(term))
+        scores.append((score, task))
+    best = lambda item: item[0]
+    if limit is None:
+        return [task for score, task in sorted(scores, key=best, reverse=True)]
+    return [task for score, task in heapq.nlargest(limit, scores, key=best)]
+
+# How many tasks there are, how many of them have each word starting with a
+# term, and the tasks matching every term and check with their position
+def search_part(tasks, terms, checks):
+    prefixes = tuple(terms)
+    total = 0
+    counts = Counter()
+    found = []
+    for i, task in enumerate(tasks):
+        total += 1
+        # A task without a query word anywhere in its text has no word
+        # starting with one either, that is quick to rule out
+        text = (task['title'] + ' ' + task['description']).lower()
+        if not any(term in text for term in terms):
+            continue
+        matching = {word: weight for word, weight in text_weights(task).items() if word.startswith(prefixes)}
+        counts.update(matching.keys())
+        if all(any(word.startswith(term) for word in matching) for term in terms) and \
+                all(condition_matches(task, c) for c in checks):
+            found.append((i, task, matching))
+    return total, counts, found
+
+# Parallel scans. A query no index can answer (title:voic, tag:ex,
+# priority!=low, or words when there is no text index) checks every task.
+# From PARALLEL_MIN tasks on (TASKS_PARALLEL_MIN) the tasks are split into
+# parts that worker processes check at the same time, one per core
+# (TASKS_WORKERS), and the results are put back together in order. The
+# workers are forked, so they start with the tasks already in memory and only
+# send back positions. Without fork (Windows) or with one core, everything
+# stays in this process.
+PARALLEL_MIN = int(os.environ.get('TASKS_PARALLEL_MIN', 200000))
+
+# Cores this process may run on, which can be fewer than the machine has
+def usable_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+PARALLEL_WORKERS = int(os.environ.get('TASKS_WORKERS', 0)) or usable_cores()
+# More parts than workers, so one slow part doesn't keep the others waiting
+# and the first results come back early
+PARTS_PER_WORKER = 4
+
+# The list being scanned, for the forked workers to read
+scanned = None
+
+def use_parallel(count):
+    return count >= PARALLEL_MIN and PARALLEL_WORKERS > 1 and 'fork' in multiprocessing.get_all_start_methods()
+
+# Runs func(start, end, *args) for the parts of tasks in the workers and
+# yields what each part returned, in order. Stopping early cancels the
+# parts that haven't started.
+def parallel_parts(tasks, func, *args):
+    global scanned
+    step = -(-len(tasks) // (PARALLEL_WORKERS * PARTS_PER_WORKER))
+    starts = range(0, len(tasks), step)
+    ends = [min(start + step, len(tasks)) for start in starts]
+    scanned = tasks
+    executor = ProcessPoolExecutor(PARALLEL_WORKERS, mp_context=multiprocessing.get_context('fork'))
+    try:
+        yield from executor.map(func, starts, ends, *(repeat(arg) for arg in args))
+    finally:
+        scanned = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def filter_slice(start, end, checks):
+    return [i for i in range(start, end) if all(condition_matches(scanned[i], c) for c in checks)]
+
+def search_slice(start, end, terms, checks):
+    total, counts, found = search_part(scanned[start:end], terms, checks)
+    return total, counts, [(start + i, matching) for i, task, matching in found]
+
+# The tasks matching all checks, in the same order as tasks
+def parallel_filter(tasks, checks):
+    for positions in parallel_parts(tasks, filter_slice, checks):
+        yield from map(tasks.__getitem__, positions)
+
+# A parsed query (see parse_query) checked on tasks one at a time, for stores
+# without indexes to ask: TaskStore.scan() and the archive
+def scan_tasks(tasks, conditions, limit=None):
+    words = ' '.join(value for field, op, value in conditions if field == 'text')
+    checks = [c for c in conditions if c[0] != 'text']
+    if words:
+        return iter(scan_search(tasks, words, checks, limit))
+    if checks:
+        tasks = (t for t in tasks if all(condition_matches(t, c) for c in checks))
+    return islice(tasks, limit)
+
+# 'YYYY/MM/DD' -> day number (date.toordinal), without the cost of strptime
+def due_ordinal(due_date):
+    year, month, day = due_date.split('/')
+    return date(int(year), int(month), int(day)).toordinal()
+
+def normalize_date(due_date):
+    return date.fromordinal(due_ordinal(due_date)).strftime('%Y/%m/%d')
+
+# Tasks kept sorted by key(task) in a list of (key, length of id, id), so a
+# sorted view is read straight from the list and a change is one binary search
+# plus one insert. Equal keys are ordered by id (shorter first, so 9 < 10).
+class SortedIndex:
+    def __init__(self, tasks=(), key=None, fields=()):
+        self.key = key or self.key
+        self.fields = fields or self.fields
+        self.entry_of = {t.id: self.entry(t) for t in tasks}
+        self.entries = sorted(self.entry_of.values())
+
+    def entry(self, task):
+        return (self.key(task), len(task.id), task.id)
+
+    def add(self, task):
+        entry = self.entry(task)
+        self.entry_of[task.id] = entry
+        bisect.insort(self.entries, entry)
+
+    def remove(self, task):
+        entry = self.entry_of.pop(task.id, None)
+        if entry is not None:
+            del self.entries[bisect.bisect_left(self.entries, entry)]
+
+    def ids(self, reverse=False):
+        entries = reversed(self.entries) if reverse else self.entries
+        return (entry[2] for entry in entries)
+
+    # Positions of the tasks with low <= key < high
+    def key_span(self, low, high):
+        return bisect.bisect_left(self.entries, (low,)), bisect.bisect_left(self.entries, (high,))
+
+    def ids_in(self, start, end):
+        return (self.entries[i][2] for i in range(start, end))
+
+# Due dates as day numbers, so counting the tasks due between two days is two
+# binary searches instead of a scan.
+class DueIndex(SortedIndex):
+    fields = ('due date',)
+
+    def key(self, task):
+        return task.due
+
+    # first and last day are both included
+    def count_between(self, first, last):
+        start, end = self.key_span(first, last + 1)
+        return end - start
+
+    def buckets(self, today=None):
+        return due_buckets(self.count_between, today)
+
+# Same buckets get_task_dues() always showed, for any day as "today", from
+# count_between(first day, last day)
+def due_buckets(count_between, today=None):
+    today = (today or date.today()).toordinal()
+    return {
+        'today': count_between(today, today),
+        'week': count_between(today + 1, today + 7),
+        'month': count_between(today + 8, today + 30),
+        'overdue': count_between(-1, today - 1),
+    }
+
+# Every counter statistics_screen() shows, counted in one pass and then kept
+# up to date on each change, so the dashboard never has to look at every task.
+class TaskStats:
+    fields = ('done', 'priority')
+
+    def __init__(self, tasks=()):
+        self.total = 0
+        self.done = 0
+        self.priorities = Counter()
+        for t in tasks:
+            self.add(t)
+
+    def add(self, task):
+        self.total += 1
+        self.done += bool(task['done'])
+        self.priorities[task['priority']] += 1
+
+    def remove(self, task):
+        self.total -= 1
+        self.done -= bool(task['done'])
+        self.priorities[task['priority']] -= 1
+
+    @property
+    def pending(self):
+        return self.total - self.done
+
+    # Percentage of all tasks, 0 when there are no tasks yet
+    def rate(self, count):
+        return count * 100 / self.total if self.total else 0
+
+# Tag -> ids of the tasks that have it, so a tag filter only looks at the
+# tasks with that tag and the count of a tag is the size of its entry.
+# The ids are dict keys, which keeps them in the order they were tagged.
+class TagIndex:
+    fields = ('tag',)
+
+    def __init__(self, tasks=()):
+        self.ids = {}
+        for t in tasks:
+            self.add(t)
+
+    def add(self, task):
+        for tag in task.tags:
+            self.ids.setdefault(tag, {})[task.id] = None
+
+    def remove(self, task):
+        for tag in task.tags:
+            ids = self.ids[tag]
+            del ids[task.id]
+            if not ids:
+                del self.ids[tag]
+
+    # Most tasks having any of tags can give
+    def count(self, tags):
+        return sum(len(self.ids.get(tag, ())) for tag in tags)
+
+    def any_of(self, tags):
+        if len(tags) == 1:
+            return self.ids.get(tags[0], {})
+        found = {}
+        for tag in tags:
+            found.update(self.ids.get(tag, {}))
+        return found
+
+    # Tasks with a tag from every group, i.e, [('study',), ('exam', 'quiz')] is
+    # study AND (exam OR quiz). Only the smallest group is walked.
+    def find(self, groups):
+        groups = sorted((self.any_of(tags) for tags in groups), key=len)
+        return [task_id for task_id in groups[0] if all(task_id in ids for ids in groups[1:])]
+
+    def counts(self):
+        return Counter({tag: len(ids) for tag, ids in self.ids.items()})
+
+# Indexes a TaskStore can keep. Each one has add(task) and remove(task) and
+# lists the task fields it depends on, so an update only touches the indexes
+# that care about the changed fields.
+# title, priority, due and done are also the orders sort_tasks() offers.
+INDEXES = {
+    'text': TextIndex,
+    'due': DueIndex,
+    'stats': TaskStats,
+    'tag': TagIndex,
+    'title': lambda tasks: SortedIndex(tasks, lambda t: t.title.lower(), ('title',)),
+    'priority': lambda tasks: SortedIndex(tasks, lambda t: (t.rank, t.due), ('priority', 'due date')),
+    'done': lambda tasks: SortedIndex(tasks, lambda t: t.done, ('done',)),
+}
+SORT_ORDERS = ['title', 'priority', 'due', 'done']
+
+# Query language of search_task(), 'list --query' and export filters, i.e,
+#   priority=high done=false tag=study tag=exam,quiz due<2025/01/01 "some words"
+# = and != work on every field, < <= > >= on due, : (contains) on tag and
+# title. tag=a,b means a task with tag a or b, several tag= must all match.
+# Anything else is searched for in titles and descriptions.
+QUERY_OPS = {
+    'priority': ('=', '!='),
+    'done': ('=', '!='),
+    'due': ('=', '!=', '<', '<=', '>', '>='),
+    'tag': ('=', '!=', ':'),
+    'title': ('=', '!=', ':'),
+    'id': ('=', '!='),
+}
+QUERY_PART = re.compile(r'(\w+)(<=|>=|!=|<|>|=|:)(.*)')
+QUERY_ATTRS = {'priority': 'rank', 'done': 'done', 'due': 'due', 'title': 'title', 'id': 'id'}
+COMPARE = {'=': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+           '>': operator.gt, '>=': operator.ge}
+
+# Value in the form Task keeps it (priority as rank, due as day number, tag=
+# and tag!= as a tuple of tags), None if invalid
+def query_value(field, op, value):
+    value = value.strip()
+    if field == 'id':
+        return value or None
+    value = value.lower()
+    if field == 'tag' and op != ':':
+        return split_tags(value) or None
+    if field == 'priority':
+        return PRIORITIES.index(value) if value in PRIORITIES else None
+    if field == 'done':
+        return {'true': True, 'false': False}.get(value)
+    if field == 'due':
+        value = valid_date(value)
+        return due_ordinal(value) if value else None
+    return value or None
+
+# Returns a list of (field, op, value). The words to search for become one
+# ('text', ':', words) condition. Raises ValueError for a bad part.
+def parse_query(text):
+    conditions = []
+    words = []
+    for part in shlex.split(text):
+        match = QUERY_PART.fullmatch(part)
+        if not match or match.group(1).lower() not in QUERY_OPS:
+            words.append(part)
+            continue
+        field, op, value = match.groups()
+        field = field.lower()
+        value = query_value(field, op, value)
+        if op not in QUERY_OPS[field] or value is None:
+            raise ValueError(f'Invalid query: {part}. Use i.e, priority=high done=false tag=study due<2025/01/01')
+        conditions.append((field, op, value))
+    if words:
+        conditions.append(('text', ':', ' '.join(words)))
+    return conditions
+
+def condition_matches(task, condition):
+    field, op, value = condition
+    if field == 'tag':
+        if op == ':':
+            return any(value in tag for tag in task.tags)
+        return any(tag in task.tags for tag in value) == (op == '=')
+    actual = getattr(task, QUERY_ATTRS[field])
+    if field == 'title':
+        actual = actual.lower()
+    if op == ':':
+        return value in actual
+    return COMPARE[op](actual, value)
+
+# The [low, high) range the =, <, <=, >, >= conditions on field leave, and
+# those conditions. Only for fields kept as whole numbers (priority, done, due).
+def query_range(conditions, field):
+    low, high = -math.inf, math.inf
+    used = []
+    for condition in conditions:
+        name, op, value = condition
+        if name != field or op == '!=':
+            continue
+        value = int(value)
+        if op in ('=', '>='):
+            low = max(low, value)
+        elif op == '>':
+            low = max(low, value + 1)
+        if op in ('=', '<='):
+            high = min(high, value + 1)
+        elif op == '<':
+            high = min(high, value)
+        used.append(condition)
+    return (low, high, used) if used else None
+
+# ID allocators. Both give out IDs in O(1) that can't collide with each other.
+# see() is called with every ID already in the store, to_meta() is what the
+# store saves so a restart continues where it left off.
+# counter (default): 1, 2, 3... starting above the highest numeric ID, so the
+# old random IDs stay valid.
+class CounterIds:
+    def __init__(self, meta=None):
+        self.next_id = (meta or {}).get('next_id', 1)
+
+    def see(self, task_id):
+        if task_id.isdecimal() and int(task_id) >= self.next_id:
+            self.next_id = int(task_id) + 1
+
+    def allocate(self, count=1):
+        first = self.next_id
+        self.next_id += count
+        return [str(i) for i in range(first, first + count)]
+
+    def to_meta(self):
+        return {'next_id': self.next_id}
+
+CROCKFORD = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+# ulid: 26 character IDs (48 bit millisecond time + 80 random bits) that sort
+# by creation time. IDs made in the same millisecond count up from the last one.
+class UlidIds:
+    def __init__(self, meta=None):
+        self.last = 0
+
+    def see(self, task_id):
+        pass
+
+    def allocate(self, count=1):
+        ids = []
+        for _ in range(count):
+            value = (int(time.time() * 1000) << 80) | int.from_bytes(os.urandom(10), 'big')
+            if value >> 80 == self.last >> 80 and value <= self.last:
+                value = self.last + 1
+            self.last = value
+            ids.append(''.join(CROCKFORD[(value >> shift) & 31] for shift in range(125, -5, -5)))
+        return ids
+
+    def to_meta(self):
+        return {}
+
+ID_ALLOCATORS = {'counter': CounterIds, 'ulid': UlidIds}
+
+# Pick how new IDs look with TASKS_ID_MODE=counter (default) or TASKS_ID_MODE=ulid
+def make_id_allocator(meta=None, mode=None):
+    mode = mode or os.environ.get('TASKS_ID_MODE', 'counter')
+    if mode not in ID_ALLOCATORS:
+        raise ValueError(f'Unknown ID mode: {mode}. Choose from {", ".join(ID_ALLOCATORS)}')
+    return ID_ALLOCATORS[mode](meta)
+
+def meta_path(path):
+    return os.path.splitext(path)[0] + '.meta.json'
+
+def load_meta(path):
+    try:
+        with open(path, 'rb') as f:
+            return json_loads(f.read())
+    except FileNotFoundError:
+        return {}
+
+# Binary snapshot of tasks.json (TASKS_SNAPSHOT=1), so a big store opens in
+# no time: tasks.snapshot is mapped into memory (mmap) and a task is only
+# decoded when it is asked for. The file is
+#   SNAPSHOT_PREFIX      magic, where the header is and how long it is
+#   string heap          id, title, description, tag text and extra keys
+#                        (JSON) of every task, one after the other, UTF-8
+#   records              one SNAPSHOT_RECORD per task, in tasks.json order:
+#                        where its strings start and their lengths, due day,
+#                        version, priority rank and done
+#   id index             record numbers ordered by id, for binary search
+#   sort orders          record numbers in the order of each index in
+#                        SORT_ORDERS, the same order the index would give
+#   header               JSON: offsets of the parts, the tasks.json it was
+#                        made from (file_state) and the counts the dashboard
+#                        shows, so those need no task decoded either
+# tasks.json stays the file everything else reads and writes. The snapshot
+# is written next to it on every compaction, and when a session finds it
+# missing or made from another tasks.json it makes a new one.
+SNAPSHOT = os.environ.get('TASKS_SNAPSHOT') == '1'
+SNAPSHOT_MAGIC = b'TASKSNP1'
+SNAPSHOT_PREFIX = struct.Struct('<8sQQ')
+SNAPSHOT_RECORD = struct.Struct('<QIIIIIiIBB')
+SNAPSHOT_DUE = struct.Struct('<i')
+SNAPSHOT_DUE_AT = 28
+
+def snapshot_path(path):
+    return os.path.splitext(path)[0] + '.snapshot'
+
+# tasks are written as they are, source is the file_state of the tasks.json
+# they were read from. A snapshot is only a copy, so failing to write one
+# (another session has the file open on Windows, ...) is not an error.
+def write_snapshot(path, tasks, source):
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    header = {'format': 1, 'byteorder': sys.byteorder, 'source': list(source), 'count': len(tasks)}
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, 0, 0))
+            header['heap'] = f.tell()
+            heap, records, ids = [], [], []
+            offset = 0
+            for t in tasks:
+                extra = json_dumps(t.extra).encode() if t.extra else b''
+                fields = [t.id.encode(), t.title.encode(), t.description.encode(), join_tags(t.tags).encode(), extra]
+                heap.append(b''.join(fields))
+                records.append(SNAPSHOT_RECORD.pack(offset, *map(len, fields), t.due, t.version, t.rank, t.done))
+                offset += len(heap[-1])
+                ids.append(fields[0])
+            f.write(b''.join(heap))
+            header['records'] = f.tell()
+            f.write(b''.join(records))
+            # Orders are sorted keys turned into record numbers
+            header['ids'] = f.tell()
+            f.write(array('I', sorted(range(len(tasks)), key=ids.__getitem__)).tobytes())
+            header['orders'] = {}
+            for order in SORT_ORDERS:
+                keys = list(map(INDEXES[order](()).entry, tasks))
+                header['orders'][order] = f.tell()
+                f.write(array('I', sorted(range(len(tasks)), key=keys.__getitem__)).tobytes())
+            stats = TaskStats(tasks)
+            header.update(total=stats.total, done=stats.done, priorities=dict(stats.priorities),
+                          tags=dict(Counter(tag for t in tasks for tag in t.tags)),
+                          max_id=max((t.id for t in tasks if t.id.isdecimal()), key=int, default=None))
+            start = f.tell()
+            data = json_dumps(header).encode()
+            f.write(data)
+            f.seek(0)
+            f.write(SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, start, len(data)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except (OSError, struct.error):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+# A snapshot file opened read only with mmap. Other sessions replace the
+# file rather than change it, so what is mapped here never changes.
+class Snapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, start, length = SNAPSHOT_PREFIX.unpack_from(self.data)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f'{path} is not a snapshot')
+        self.header = json_loads(self.data[start:start + length])
+        if self.header['byteorder'] != sys.byteorder:
+            raise ValueError(f'{path} was made on another kind of machine')
+        self.count = self.header['count']
+        self.heap = self.header['heap']
+        self.records = self.header['records']
+        self.by_id = self.numbers(self.header['ids'])
+
+    # The record numbers stored at offset, read in place
+    def numbers(self, offset):
+        return memoryview(self.data)[offset:offset + 4 * self.count].cast('I')
+
+    def fields(self, record):
+        return SNAPSHOT_RECORD.unpack_from(self.data, self.records + record * SNAPSHOT_RECORD.size)
+
+    def id_bytes(self, record):
+        start, id_length = self.fields(record)[:2]
+        return self.data[self.heap + start:self.heap + start + id_length]
+
+    def due(self, record):
+        return SNAPSHOT_DUE.unpack_from(self.data, self.records + record * SNAPSHOT_RECORD.size + SNAPSHOT_DUE_AT)[0]
+
+    def task(self, record):
+        start, *lengths, due, version, rank, done = self.fields(record)
+        data = self.data[self.heap + start:self.heap + start + sum(lengths)]
+        texts = []
+        for length in lengths:
+            texts.append(data[:length])
+            data = data[length:]
+        task = Task.__new__(Task)
+        task.id, task.title, task.description = (text.decode() for text in texts[:3])
+        task.tags = split_tags(texts[3].decode())
+        task.extra = json_loads(texts[4]) if texts[4] else None
+        task.due, task.version, task.rank, task.done = due, version, rank, bool(done)
+        return task
+
+    def tasks(self):
+        return map(self.task, range(self.count))
+
+    # Record number of the task with task_id, None if there is none
+    def find(self, task_id):
+        key = task_id.encode()
+        i = bisect.bisect_left(self.by_id, key, key=self.id_bytes)
+        if i < self.count and self.id_bytes(self.by_id[i]) == key:
+            return self.by_id[i]
+        return None
+
+    def order(self, name, reverse=False):
+        numbers = self.numbers(self.header['orders'][name])
+        return reversed(numbers) if reverse else numbers
+
+    # Tasks due from first to last (day numbers, both included)
+    def count_due(self, first, last):
+        due = self.order('due')
+        return bisect.bisect_left(due, last + 1, key=self.due) - bisect.bisect_left(due, first, key=self.due)
+
+# The snapshot of path when it was made from the tasks.json with state, else None
+def open_snapshot(path, state):
+    if state is None:
+        return None
+    try:
+        snapshot = Snapshot(path)
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+    return snapshot if snapshot.header['source'] == list(state) else None
+
+# TaskStore.tasks when it was loaded from a snapshot: the same dict-like id ->
+# task, but tasks stay in the snapshot until they are asked for and only the
+# ones changed, removed or added since are kept here. Counts and sorted views
+# come from what the snapshot has precomputed, corrected for those few tasks.
+class SnapshotTasks:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        # Tasks of the snapshot changed since, by id
+        self.changed = {}
+        # Ids of tasks of the snapshot removed since
+        self.removed = set()
+        # Tasks not in the snapshot (or removed and added again), in the order they came
+        self.added = {}
+
+    def get(self, task_id, default=None):
+        if task_id in self.added:
+            return self.added[task_id]
+        if task_id in self.changed:
+            return self.changed[task_id]
+        if task_id in self.removed:
+            return default
+        record = self.snapshot.find(task_id)
+        return default if record is None else self.snapshot.task(record)
+
+    def __getitem__(self, task_id):
+        task = self.get(task_id)
+        if task is None:
+            raise KeyError(task_id)
+        return task
+
+    def __contains__(self, task_id):
+        return task_id in self.added or task_id in self.changed or \
+            (task_id not in self.removed and self.snapshot.find(task_id) is not None)
+
+    # Like a dict: a task already there keeps its place, a new one goes last
+    def __setitem__(self, task_id, task):
+        if task_id in self.changed or (task_id not in self.added and task_id not in self.removed
+                                       and self.snapshot.find(task_id) is not None):
+            self.changed[task_id] = task
+        else:
+            self.added[task_id] = task
+
+    def pop(self, task_id):
+        if task_id in self.added:
+            return self.added.pop(task_id)
+        task = self[task_id]
+        self.changed.pop(task_id, None)
+        self.removed.add(task_id)
+        return task
+
+    def __len__(self):
+        return self.snapshot.count - len(self.removed) + len(self.added)
+
+    def __iter__(self):
+        for record in range(self.snapshot.count):
+            task_id = self.snapshot.id_bytes(record).decode()
+            if task_id not in self.removed:
+                yield task_id
+        yield from self.added
+
+    def values(self):
+        if not self.changed and not self.removed:
+            yield from self.snapshot.tasks()
+        else:
+            for task in self.snapshot.tasks():
+                if task.id not in self.removed:
+                    yield self.changed.get(task.id, task)
+        yield from self.added.values()
+
+    # The tasks of the snapshot changed or removed since, as the snapshot has them
+    def originals(self):
+        return [self.snapshot.task(self.snapshot.find(task_id)) for task_id in [*self.changed, *self.removed]]
+
+    # What replaces them
+    def overlay(self):
+        return [*self.changed.values(), *self.added.values()]
+
+    def stats(self):
+        header = self.snapshot.header
+        stats = TaskStats()
+        stats.total, stats.done = header['total'], header['done']
+        stats.priorities.update(header['priorities'])
+        for task in self.originals():
+            stats.remove(task)
+        for task in self.overlay():
+            stats.add(task)
+        return stats
+
+    def tag_counts(self):
+        counts = Counter(self.snapshot.header['tags'])
+        for task in self.originals():
+            counts.subtract(task.tags)
+        for task in self.overlay():
+            counts.update(task.tags)
+        return +counts
+
+    def due_counts(self, today=None):
+        counts = due_buckets(self.snapshot.count_due, today)
+        before, now = DueIndex(self.originals()).buckets(today), DueIndex(self.overlay()).buckets(today)
+        return {bucket: count - before[bucket] + now[bucket] for bucket, count in counts.items()}
+
+    # The snapshot's order with the changed and added tasks merged in
+    def sorted_tasks(self, order, reverse=False):
+        entry = INDEXES[order](()).entry
+        skip = self.removed | self.changed.keys()
+        tasks = (task for task in map(self.snapshot.task, self.snapshot.order(order, reverse)) if task.id not in skip)
+        overlay = sorted(self.overlay(), key=entry, reverse=reverse)
+        return heapq.merge(tasks, overlay, key=entry, reverse=reverse)
+
+# Keeps tasks.json in memory for the whole session.
+# tasks is a dict of id -> task, so lookups by ID don't scan the list and the
+# dict keeps the same order as the file.
+# Every change is appended as one line to tasks.journal (JSON Lines) instead of
+# rewriting tasks.json. On load the journal is replayed on top of tasks.json,
+# and once it has COMPACT_EVERY entries it is folded back into tasks.json.
+# The indexes in INDEXES are built the first time they are needed and then
+# kept up to date on every change.
+# The ID allocator's state and the order chosen in sort_tasks() are saved next
+# to tasks.json in tasks.meta.json.
+#
+# Several sessions can share the files. Changes are written while holding
+# tasks.lock, after first catching up with what the others wrote (refresh).
+# Reading needs no lock: tasks.json is only ever replaced whole and the
+# journal only appended to. Each task has a version, update() and delete()
+# can be given the version the caller saw to detect changes made since.
+class TaskStore:
+    def __init__(self, path=TASKS_FILE, id_mode=None):
+        self.path = path
+        self.journal_path = journal_path(path)
+        self.meta_path = meta_path(path)
+        self.snapshot_path = snapshot_path(path)
+        self.archive = Archive(os.path.splitext(path)[0] + '.archive.jsonl.gz')
+        self.lock = FileLock(os.path.splitext(path)[0] + '.lock')
+        self.id_mode = id_mode
+        self.ids = None
+        self.sort_order = None
+        self.journal = None
+        self.journal_count = 0
+        self.journal_offset = 0
+        self.file_state = None
+        self.tasks = {}
+        self.indexes = {}
+        # id -> {version: fields changed to get there}, for merging updates
+        self.history = {}
+        self.loaded = False
+        self.dirty = False
+
+    def load(self, repair=False):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        while True:
+            state = file_state(self.path)
+            snapshot = open_snapshot(self.snapshot_path, state) if SNAPSHOT else None
+            tasks = [] if snapshot else [Task(t) for t in load_task(self.path)]
+            entries, offset = read_journal(self.journal_path, repair=repair)
+            # Another session compacted while we were reading, read again
+            if file_state(self.path) == state:
+                break
+        self.file_state = state
+        self.journal_offset = offset
+        self.tasks = {}
+        self.indexes = {}
+        self.history = {}
+        self.loaded = True
+
+        # The allocator has to know every ID ever used before it can give out new ones
+        meta = load_meta(self.meta_path)
+        self.ids = make_id_allocator(meta, self.id_mode)
+        self.sort_order = meta.get('sort')
+        for t in tasks:
+            self.ids.see(t['id'])
+        if snapshot and snapshot.header['max_id']:
+            self.ids.see(snapshot.header['max_id'])
+        for entry in entries:
+            if entry['op'] == 'add':
+                self.ids.see(entry['task']['id'])
+
+        for t in tasks:
+            # Old random IDs could collide, give the duplicate a new one instead of dropping it
+            if t['id'] in self.tasks:
+                t['id'] = self.new_id()
+                self.dirty = True
+            self.tasks[t['id']] = t
+        if snapshot:
+            self.tasks = SnapshotTasks(snapshot)
+        elif SNAPSHOT and state is not None and not self.dirty:
+            # Missing or made from another tasks.json, the next session opens this one
+            write_snapshot(self.snapshot_path, tasks, state)
+
+        for entry in entries:
+            self.apply(entry)
+        self.journal_count = len(entries)
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    # Catches up with what other sessions wrote since we last looked. If one
+    # of them compacted, tasks.json is read again, otherwise only the new
+    # end of the journal. Returns the ids of the tasks the new entries
+    # changed, or None when everything was read again.
+    def refresh(self, repair=False):
+        if not self.loaded or file_state(self.path) != self.file_state:
+            self.load(repair)
+            return None
+        entries, self.journal_offset = read_journal(self.journal_path, self.journal_offset, repair)
+        for entry in entries:
+            self.apply(entry)
+        self.journal_count += len(entries)
+        return [entry['task']['id'] if entry['op'] == 'add' else entry['id'] for entry in entries]
+
+    # Changes whenever any session writes, cheap enough to look at every second
+    def state(self):
+        return file_state(self.path), file_state(self.journal_path)
+
+    # Applies one journal entry. Replaying the same entry twice gives the same
+    # result, so a crash during compaction is harmless.
+    def apply(self, entry):
+        op = entry['op']
+        if op == 'add':
+            task = Task(entry['task'])
+            if task.id in self.tasks:
+                self.remove(task.id)
+            self.insert(task)
+        elif op in ('update', 'mark') and entry['id'] in self.tasks:
+            fields = entry['fields'] if op == 'update' else {'done': True}
+            self.change(self.tasks[entry['id']], fields, entry.get('version'))
+        elif op == 'delete' and entry['id'] in self.tasks:
+            self.remove(entry['id'])
+
+    def log(self, entry):
+        self.log_many([entry])
+
+    def log_many(self, entries):
+        if self.journal is None:
+            self.journal = open(self.journal_path, 'ab')
+        data = ''.join(json_dumps(entry) + '\n' for entry in entries).encode()
+        self.journal.write(data)
+        self.journal.flush()
+        if metrics:
+            metrics.count('journal bytes written', len(data))
+            metrics.count('journal records written', len(entries))
+        self.journal_offset = self.journal.tell()
+        self.journal_count += len(entries)
+
+    # Makes the journal durable and compacts it once it gets long
+    def save(self):
+        if self.journal is not None:
+            os.fsync(self.journal.fileno())
+        if self.dirty or self.journal_count >= COMPACT_EVERY:
+            with self.lock:
+                self.refresh(repair=True)
+                self.compact()
+
+    # Only called holding the lock and caught up, so tasks.json gets every
+    # session's changes
+    def compact(self):
+        tasks = list(self.tasks.values())
+        save_task(tasks, self.path)
+        self.save_meta()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.file_state = file_state(self.path)
+        self.journal_offset = 0
+        self.journal_count = 0
+        self.dirty = False
+        if SNAPSHOT:
+            write_snapshot(self.snapshot_path, tasks, self.file_state)
+            # Start over from the new snapshot, so the changes kept aside stay few
+            snapshot = isinstance(self.tasks, SnapshotTasks) and open_snapshot(self.snapshot_path, self.file_state)
+            if snapshot:
+                self.tasks = SnapshotTasks(snapshot)
+
+    def save_meta(self):
+        save_task({**self.ids.to_meta(), 'sort': self.sort_order}, self.meta_path)
+
+    def close(self):
+        self.save()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def new_id(self):
+        return self.new_ids(1)[0]
+
+    def new_ids(self, count):
+        self.ensure_loaded()
+        return self.ids.allocate(count)
+
+    def get(self, task_id):
+        self.ensure_loaded()
+        return self.tasks.get(task_id)
+
+    def __contains__(self, task_id):
+        self.ensure_loaded()
+        return task_id in self.tasks
+
+    def all(self):
+        self.ensure_loaded()
+        return list(self.tasks.values())
+
+    def index(self, name):
+        self.ensure_loaded()
+        if name not in self.indexes:
+            self.indexes[name] = INDEXES[name](self.tasks.values())
+        return self.indexes[name]
+
+    def insert(self, task):
+        self.tasks[task.id] = task
+        self.ids.see(task.id)
+        for index in self.indexes.values():
+            index.add(task)
+
+    def remove(self, task_id):
+        task = self.tasks.pop(task_id)
+        self.history.pop(task_id, None)
+        for index in self.indexes.values():
+            index.remove(task)
+        return task
+
+    # Returns the task as stored, its ID is a new one if another session took
+    # the ID it was given in the meantime
+    def add(self, task):
+        return self.add_many([task])[0]
+
+    # Adds many tasks with a single journal write
+    def add_many(self, tasks):
+        with self.lock:
+            self.refresh(repair=True)
+            tasks = [Task(t) for t in tasks]
+            for task in tasks:
+                if task.id in self.tasks:
+                    task.id = self.new_id()
+                self.insert(task)
+            self.log_many([{'op': 'add', 'task': task} for task in tasks])
+        return tasks
+
+    def change(self, task, fields, version=None):
+        touched = [index for index in self.indexes.values() if set(index.fields) & set(fields)]
+        for index in touched:
+            index.remove(task)
+        task.update(fields)
+        for index in touched:
+            index.add(task)
+        task.version = version or task.version + 1
+        # Tasks from a snapshot are decoded afresh every time, this keeps the change
+        self.tasks[task.id] = task
+        self.history.setdefault(task.id, {})[task.version] = set(fields)
+
+    # Fields changed since the task was at version, None if we can't tell
+    # (the changes were compacted before this session saw them)
+    def changed_since(self, task, version):
+        history = self.history.get(task.id, {})
+        changes = [history.get(v) for v in range(version + 1, task.version + 1)]
+        if None in changes:
+            return None
+        return set().union(*changes)
+
+    # Finds the task again after catching up. With version (what the caller
+    # saw), changes made since are fine unless they touch one of fields.
+    def checked_task(self, task_id, version, fields=None):
+        task = self.tasks.get(task_id)
+        if task is None:
+            raise ConflictError(f'Task {task_id} was deleted in another session')
+        if version is not None and version > task.version:
+            raise ConflictError(f'Task {task_id} is at version {task.version}, there is no version {version} yet')
+        if version is not None and task.version != version:
+            changed = self.changed_since(task, version)
+            if fields is None or changed is None or changed & set(fields):
+                raise ConflictError(f'Task {task_id} was changed in another session, try again')
+        return task
+
+    def update(self, task_id, fields, version=None):
+        with self.lock:
+            self.refresh(repair=True)
+            task = self.checked_task(task_id, version, fields)
+            self.change(task, fields)
+            self.log({'op': 'update', 'id': task_id, 'fields': fields, 'version': task.version})
+        return task
+
+    def mark_done(self, task_id):
+        with self.lock:
+            self.refresh(repair=True)
+            task = self.checked_task(task_id, None)
+            self.change(task, {'done': True})
+            self.log({'op': 'mark', 'id': task_id, 'version': task.version})
+        return task
+
+    def delete(self, task_id, version=None):
+        with self.lock:
+            self.refresh(repair=True)
+            self.checked_task(task_id, version)
+            task = self.remove(task_id)
+            self.log({'op': 'delete', 'id': task_id})
+        return task
+
+    # Deletes many tasks with a single journal write, ids that are gone
+    # already are skipped. tasks.json is rewritten at the next save, since
+    # it would be mostly deleted tasks otherwise.
+    def delete_many(self, task_ids):
+        with self.lock:
+            self.refresh(repair=True)
+            task_ids = [task_id for task_id in dict.fromkeys(task_ids) if task_id in self.tasks]
+            if len(task_ids) > len(self.tasks) // 10:
+                # Building the indexes again when next needed is quicker than
+                # taking this many tasks out of them one by one
+                self.indexes = {}
+            tasks = [self.remove(task_id) for task_id in task_ids]
+            if tasks:
+                self.log_many([{'op': 'delete', 'id': task.id} for task in tasks])
+                self.dirty = True
+        return tasks
+
+    # Sorted view from one of the sorted indexes, nothing is rewritten.
+    # priority sorts by priority and then due date.
+    def sorted_tasks(self, order, reverse=False):
+        self.ensure_loaded()
+        if order not in self.indexes and isinstance(self.tasks, SnapshotTasks):
+            return self.tasks.sorted_tasks(order, reverse)
+        return (self.tasks[task_id] for task_id in self.index(order).ids(reverse))
+
+    # Remembering an order only writes tasks.meta.json, never tasks.json
+    def set_sort_order(self, order, reverse=False):
+        with self.lock:
+            self.refresh(repair=True)
+            self.sort_order = [order, reverse]
+            self.save_meta()
+
+    # All tasks in the order last picked in sort_tasks(), or as added.
+    # Without a sort order nothing has to be loaded for that (see stream()).
+    def view_tasks(self):
+        if not self.loaded and not load_meta(self.meta_path).get('sort'):
+            return self.stream()
+        self.ensure_loaded()
+        if self.sort_order:
+            return self.sorted_tasks(*self.sort_order)
+        return self.iter_tasks()
+
+    # These return generators, so a screen that shows one page only looks at
+    # as many tasks as it needs for that page
+    def iter_tasks(self):
+        self.ensure_loaded()
+        return iter(self.tasks.values())
+
+    # Every index that can answer part of a query, as (how many tasks it
+    # leaves, the conditions it answers, function giving their ids)
+    def query_plans(self, conditions):
+        plans = []
+        for condition in conditions:
+            field, op, value = condition
+            if field == 'id' and op == '=':
+                found = [value] if value in self.tasks else []
+                plans.append((len(found), [condition], lambda found=found: found))
+            elif field == 'title' and op == '=':
+                plans.append(self.range_plan('title', value, value + '\0', [condition]))
+            elif field == 'text':
+                text = self.index('text')
+                plans.append((text.estimate(value), [condition], lambda value=value: text.search(value)))
+
+        groups = [c for c in conditions if c[0] == 'tag' and c[1] == '=']
+        if groups:
+            tags = self.index('tag')
+            count = min(tags.count(c[2]) for c in groups)
+            plans.append((count, groups, lambda: tags.find([c[2] for c in groups])))
+
+        for field in ('done', 'due'):
+            bounds = query_range(conditions, field)
+            if bounds:
+                plans.append(self.range_plan(field, *bounds))
+        priority, due = query_range(conditions, 'priority'), query_range(conditions, 'due')
+        if priority:
+            low, high, used = priority
+            if due and high - low == 1:
+                # One priority and a due range are one slice of the (priority, due) index
+                plans.append(self.range_plan('priority', (low, due[0]), (low, due[1]), used + due[2]))
+            else:
+                plans.append(self.range_plan('priority', (low,), (high,), used))
+        return plans
+
+    def range_plan(self, name, low, high, used):
+        index = self.index(name)
+        start, end = index.key_span(low, high)
+        return end - start, used, lambda: index.ids_in(start, end)
+
+    # Runs a parsed query (see parse_query). The index that leaves the fewest
+    # tasks is read first and the other conditions are only checked on those
+    # tasks, one at a time while the caller reads them. Without words to
+    # search for, tasks come in the order of that index, with words best
+    # matches come first.
+    def find(self, conditions, limit=None):
+        self.ensure_loaded()
+        plans = self.query_plans(conditions)
+        if plans:
+            count, used, ids = min(plans, key=lambda plan: plan[0])
+            ids = ids()
+        else:
+            count, used, ids = len(self.tasks), [], None
+        rest = [c for c in conditions if c not in used]
+        words = ' '.join(value for field, op, value in rest if field == 'text')
+        if words:
+            ids = self.index('text').search(words, among=ids)
+            count = len(ids)
+        checks = [c for c in rest if c[0] != 'text']
+        # All tasks are read in order, not looked up one by one
+        tasks = self.tasks.values() if ids is None else (self.tasks[task_id] for task_id in ids)
+        if checks and use_parallel(count):
+            return islice(parallel_filter(list(tasks), checks), limit)
+        if checks:
+            tasks = (t for t in tasks if all(condition_matches(t, c) for c in checks))
+        return islice(tasks, limit)
+
+    # Best matches first, see TextIndex.search()
+    def search(self, text, limit=None):
+        return list(self.find([('text', ':', text)], limit))
+
+    # Every task from tasks.json and the journal one at a time, without
+    # loading the store: tasks.json is streamed (see iter_json_array) and the
+    # journal, which is never long, is read first and laid over it.
+    def stream(self):
+        while True:
+            state = file_state(self.path)
+            snapshot = open_snapshot(self.snapshot_path, state) if SNAPSHOT else None
+            try:
+                f = open(self.path, 'r', encoding='utf-8')
+            except FileNotFoundError:
+                f = io.StringIO('[]')
+            entries, offset = read_journal(self.journal_path)
+            # Another session compacted in between, the journal may be gone
+            if file_state(self.path) == state:
+                break
+            f.close()
+
+        def change(task, fields, version):
+            task.update(fields)
+            task.version = version or task.version + 1
+
+        added = {}
+        changes = {}
+        deleted = set()
+        for entry in entries:
+            op = entry['op']
+            if op == 'add':
+                task = Task(entry['task'])
+                added.pop(task.id, None)
+                added[task.id] = task
+            elif op in ('update', 'mark'):
+                fields = entry['fields'] if op == 'update' else {'done': True}
+                if entry['id'] in added:
+                    change(added[entry['id']], fields, entry.get('version'))
+                else:
+                    changes.setdefault(entry['id'], []).append((fields, entry.get('version')))
+            elif op == 'delete':
+                added.pop(entry['id'], None)
+                deleted.add(entry['id'])
+        with f:
+            for task in snapshot.tasks() if snapshot else map(Task, iter_json_array(f)):
+                if task.id in deleted or task.id in added:
+                    continue
+                for fields, version in changes.get(task.id, ()):
+                    change(task, fields, version)
+                yield task
+        yield from added.values()
+
+    # find() for commands that read once and exit: before the store is loaded
+    # the tasks are streamed and checked one by one, which is quicker and
+    # needs far less memory than loading them all and building indexes for a
+    # single query. Tasks come in the order they were added, text searches
+    # best first with the same scores as find().
+    def scan(self, conditions, limit=None):
+        if self.loaded:
+            return self.find(conditions, limit)
+        return scan_tasks(self.stream(), conditions, limit)
+
+    # These three come from the snapshot's counts while their index isn't built
+    def due_counts(self, today=None):
+        self.ensure_loaded()
+        if 'due' not in self.indexes and isinstance(self.tasks, SnapshotTasks):
+            return self.tasks.due_counts(today)
+        return self.index('due').buckets(today)
+
+    def stats(self):
+        self.ensure_loaded()
+        if 'stats' not in self.indexes and isinstance(self.tasks, SnapshotTasks):
+            # Kept up to date from here on like any other index
+            self.indexes['stats'] = self.tasks.stats()
+        return self.index('stats')
+
+    def tag_counts(self):
+        self.ensure_loaded()
+        if 'tag' not in self.indexes and isinstance(self.tasks, SnapshotTasks):
+            return self.tasks.tag_counts()
+        return self.index('tag').counts()
+
+    # Tasks in lists of at most size, in display order
+    def chunks(self, size):
+        self.ensure_loaded()
+        tasks = iter(self.tasks.values())
+        while True:
+            chunk = list(islice(tasks, size))
+            if not chunk:
+                return
+            yield chunk
+
+    def __len__(self):
+        self.ensure_loaded()
+        return len(self.tasks)
+
+SQLITE_FILE = 'tasks.db'
+# add_many() with at least this many tasks fills the search table in one go
+FTS_BULK_ROWS = 1000
+
+# Column names in the tasks table for the keys used in tasks.json
+COLUMNS = {'id': 'id', 'title': 'title', 'priority': 'priority', 'due date': 'due_date',
+           'done': 'done', 'description': 'description', 'tag': 'tag'}
+
+# high = 0, medium = 1, low = 2, like Task.rank
+RANK_SQL = "(CASE priority WHEN 'high' THEN 0 WHEN 'medium' THEN 1 ELSE 2 END)"
+SORT_COLUMNS = {'title': ['title COLLATE NOCASE'], 'priority': [RANK_SQL, 'due_date'],
+                'due': ['due_date'], 'done': ['done']}
+
+QUERY_COLUMNS = {'priority': 'priority', 'done': 'done', 'due': 'due_date', 'title': 'title', 'id': 'id'}
+
+# Query values (see parse_query) as they are stored in the tasks table
+def sql_value(field, value):
+    if field == 'priority':
+        return PRIORITIES[value]
+    if field == 'done':
+        return int(value)
+    if field == 'due':
+        return date.fromordinal(value).strftime('%Y/%m/%d')
+    return value
+
+def row_to_task(row):
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'priority': row['priority'],
+        'due date': row['due_date'],
+        'done': bool(row['done']),
+        'description': row['description'],
+        'tag': row['tag'],
+        'version': row['version']
+            }
+
+INSERT_TASK = '''INSERT INTO tasks (id, pos, title, priority, due_date, done, description, tag, version)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+# Same methods as TaskStore, but the tasks live in an SQLite database and the
+# filters run as indexed SQL queries instead of scanning every task in Python.
+# pos keeps the order tasks were added in.
+# Several sessions can share the database: WAL mode lets them read while one
+# writes, and SQLite's own lock orders the writers. task_changes keeps the
+# fields every update changed, so like TaskStore an update() given an old
+# version is merged when the changes since touched other fields.
+class SqliteStore:
+    def __init__(self, path=SQLITE_FILE, json_path=TASKS_FILE, id_mode=None):
+        self.path = path
+        self.json_path = json_path
+        self.archive = Archive(path + '.archive.jsonl.gz')
+        self.id_mode = id_mode
+        self.ids = None
+        self.sort_order = None
+        self.db = None
+        self.loaded = False
+        self.next_pos = 0
+
+    def load(self):
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(f'''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id TEXT PRIMARY KEY,
+                pos INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                priority TEXT NOT NULL,
+                due_date TEXT NOT NULL,
+                done INTEGER NOT NULL,
+                description TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_pos ON tasks(pos);
+            CREATE INDEX IF NOT EXISTS idx_tasks_priority ON tasks(priority);
+            CREATE INDEX IF NOT EXISTS idx_tasks_done ON tasks(done);
+            CREATE INDEX IF NOT EXISTS idx_tasks_due_date ON tasks(due_date);
+            DROP INDEX IF EXISTS idx_tasks_tag;
+            CREATE TABLE IF NOT EXISTS task_tags (
+                tag TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                PRIMARY KEY (tag, task_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_task_tags_task ON task_tags(task_id);
+            CREATE TABLE IF NOT EXISTS task_changes (
+                task_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                fields TEXT NOT NULL,
+                PRIMARY KEY (task_id, version)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS idx_tasks_sort_title ON tasks(title COLLATE NOCASE, pos);
+            CREATE INDEX IF NOT EXISTS idx_tasks_sort_priority ON tasks({RANK_SQL}, due_date, pos);
+            CREATE INDEX IF NOT EXISTS idx_tasks_sort_due ON tasks(due_date, pos);
+            CREATE INDEX IF NOT EXISTS idx_tasks_sort_done ON tasks(done, pos);
+        ''')
+        columns = [row['name'] for row in self.db.execute('PRAGMA table_info(tasks)')]
+        if 'version' not in columns:
+            self.db.execute('ALTER TABLE tasks ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        self.fts = create_fts(self.db)
+        self.loaded = True
+        self.next_pos = self.db.execute('SELECT COALESCE(MAX(pos), -1) + 1 FROM tasks').fetchone()[0]
+
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'ids'").fetchone()
+        self.ids = make_id_allocator(json.loads(row[0]) if row else None, self.id_mode)
+        if row is None:
+            # First start with this database: look at the numeric IDs once
+            highest = self.db.execute("""SELECT MAX(CAST(id AS INTEGER)) FROM tasks
+                                         WHERE id != '' AND id NOT GLOB '*[^0-9]*'""").fetchone()[0]
+            if highest is not None:
+                self.ids.see(str(highest))
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'sort'").fetchone()
+        self.sort_order = json.loads(row[0]) if row else None
+
+        if self.db.execute("SELECT 1 FROM meta WHERE key = 'tags'").fetchone() is None:
+            self.split_old_tags()
+
+        # tasks.json is copied in once, an empty database later on is just empty
+        if self.db.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone() is None:
+            json_files = [self.json_path, journal_path(self.json_path)]
+            if self.next_pos == 0 and any(os.path.exists(p) for p in json_files):
+                migrate_json_to_sqlite(self.json_path, self)
+            else:
+                # Started without tasks.json, or a database from before the flag
+                self.db.execute("INSERT OR IGNORE INTO meta VALUES ('migrated', '1')")
+                self.db.commit()
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    # Databases from before task_tags kept the whole tag text in one column
+    def split_old_tags(self):
+        rows = self.db.execute('SELECT id, tag FROM tasks').fetchall()
+        self.db.executemany('UPDATE tasks SET tag = ? WHERE id = ?',
+                            [(join_tags(split_tags(tag)), task_id) for task_id, tag in rows])
+        self.db.executemany('INSERT OR IGNORE INTO task_tags VALUES (?, ?)',
+                            [(tag, task_id) for task_id, text in rows for tag in split_tags(text)])
+        # Two sessions opening an old database at once both get here, doing it twice is harmless
+        self.db.execute("INSERT OR IGNORE INTO meta VALUES ('tags', '1')")
+        self.db.commit()
+
+    def save(self):
+        if self.db is not None:
+            self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+            self.loaded = False
+
+    # Rows are turned into tasks one at a time while the caller reads them
+    def query(self, where='', params=()):
+        self.ensure_loaded()
+        if 'ORDER BY' not in where:
+            where += ' ORDER BY pos'
+        rows = self.db.execute(f'SELECT * FROM tasks {where}', params)
+        return (row_to_task(row) for row in rows)
+
+    # Other sessions' changes are read straight from the database, so there
+    # is nothing to catch up with (and no ids to say what changed)
+    def refresh(self, repair=False):
+        self.ensure_loaded()
+
+    # data_version goes up when another connection commits
+    def state(self):
+        self.ensure_loaded()
+        return self.db.execute('PRAGMA data_version').fetchone()[0], self.db.total_changes
+
+    # Takes SQLite's write lock now instead of at the first write, then reads
+    # the ID allocator and the next position again in case another session
+    # added tasks. The lock is held until save() commits.
+    def begin_write(self):
+        if not self.db.in_transaction:
+            self.db.execute('BEGIN IMMEDIATE')
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'ids'").fetchone()
+        if row:
+            self.ids = make_id_allocator(json.loads(row[0]), self.id_mode)
+        self.next_pos = self.db.execute('SELECT COALESCE(MAX(pos), -1) + 1 FROM tasks').fetchone()[0]
+
+    def new_id(self):
+        return self.new_ids(1)[0]
+
+    # The allocator state is written in the same transaction as the new tasks
+    def new_ids(self, count):
+        self.ensure_loaded()
+        self.begin_write()
+        ids = self.ids.allocate(count)
+        self.save_ids()
+        return ids
+
+    def save_ids(self):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('ids', ?)", (json.dumps(self.ids.to_meta()),))
+
+    def get(self, task_id):
+        self.ensure_loaded()
+        row = self.db.execute('SELECT * FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        return row_to_task(row) if row else None
+
+    def __contains__(self, task_id):
+        self.ensure_loaded()
+        return self.db.execute('SELECT 1 FROM tasks WHERE id = ?', (task_id,)).fetchone() is not None
+
+    def all(self):
+        return list(self.query())
+
+    def iter_tasks(self):
+        return self.query()
+
+    def add(self, task):
+        return self.add_many([task])[0]
+
+    # Returns the tasks as added, an ID another session took in the meantime
+    # is replaced by a new one
+    def add_many(self, tasks):
+        self.ensure_loaded()
+        self.begin_write()
+        # Tasks copied from another store keep their version, so a version
+        # seen before the move still matches
+        tasks = [{**t, 'version': t.get('version') or 0} for t in tasks]
+        taken = set()
+        for start in range(0, len(tasks) if self.next_pos else 0, 900):
+            chunk = [t['id'] for t in tasks[start:start + 900]]
+            marks = ', '.join('?' * len(chunk))
+            taken.update(row[0] for row in self.db.execute(f'SELECT id FROM tasks WHERE id IN ({marks})', chunk))
+        rows = []
+        tag_rows = []
+        for t in tasks:
+            if t['id'] in taken:
+                t['id'] = self.ids.allocate(1)[0]
+            tags = split_tags(t['tag'])
+            rows.append((t['id'], self.next_pos, t['title'], t['priority'], normalize_date(t['due date']),
+                         int(t['done']), t['description'], join_tags(tags), t['version']))
+            tag_rows += [(tag, t['id']) for tag in tags]
+            self.next_pos += 1
+            self.ids.see(t['id'])
+        self.save_ids()
+        self.db.executemany('INSERT INTO task_tags VALUES (?, ?)', tag_rows)
+        if self.fts and len(rows) >= FTS_BULK_ROWS:
+            # Filling the search table once is much faster than the trigger firing per row
+            last_rowid = self.db.execute('SELECT COALESCE(MAX(rowid), 0) FROM tasks').fetchone()[0]
+            self.db.execute('DROP TRIGGER tasks_fts_insert')
+            self.db.executemany(INSERT_TASK, rows)
+            self.db.execute('''INSERT INTO tasks_fts(rowid, title, description)
+                               SELECT rowid, title, description FROM tasks WHERE rowid > ?''', (last_rowid,))
+            create_fts(self.db)
+        else:
+            self.db.executemany(INSERT_TASK, rows)
+        return tasks
+
+    def conflict(self, task_id):
+        if task_id in self:
+            return ConflictError(f'Task {task_id} was changed in another session, try again')
+        return ConflictError(f'Task {task_id} was deleted in another session')
+
+    # WHERE for one task, only matching if it is still at version
+    def where_version(self, task_id, version):
+        if version is None:
+            return 'id = ?', [task_id]
+        return 'id = ? AND version = ?', [task_id, version]
+
+    # The version update() can go on from: the one given, or the current one
+    # when the changes made since only touched other fields
+    def merged_version(self, task_id, version, fields):
+        row = self.db.execute('SELECT version FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        if row is None or row[0] == version:
+            return version
+        if version > row[0]:
+            raise ConflictError(f'Task {task_id} is at version {row[0]}, there is no version {version} yet')
+        rows = self.db.execute('SELECT fields FROM task_changes WHERE task_id = ? AND version > ? AND version <= ?',
+                               (task_id, version, row[0])).fetchall()
+        # Databases from before task_changes have no history to merge with
+        changed = set().union(*(json.loads(r[0]) for r in rows))
+        if len(rows) == row[0] - version and not changed & set(fields):
+            return row[0]
+        raise self.conflict(task_id)
+
+    def update(self, task_id, fields, version=None):
+        self.ensure_loaded()
+        if version is not None:
+            # Checking and writing in one transaction, so no change gets in between
+            self.begin_write()
+            version = self.merged_version(task_id, version, fields)
+        sets = ', '.join(f'{COLUMNS[key]} = ?' for key in fields)
+        values = []
+        for key, value in fields.items():
+            if key == 'done':
+                value = int(value)
+            elif key == 'due date':
+                value = normalize_date(value)
+            elif key == 'tag':
+                value = join_tags(split_tags(value))
+            values.append(value)
+        where, params = self.where_version(task_id, version)
+        cursor = self.db.execute(f'UPDATE tasks SET {sets}, version = version + 1 WHERE {where}', values + params)
+        if not cursor.rowcount:
+            raise self.conflict(task_id)
+        if 'tag' in fields:
+            self.db.execute('DELETE FROM task_tags WHERE task_id = ?', (task_id,))
+            self.db.executemany('INSERT INTO task_tags VALUES (?, ?)',
+                                [(tag, task_id) for tag in split_tags(fields['tag'])])
+        task = self.get(task_id)
+        self.db.execute('INSERT OR REPLACE INTO task_changes VALUES (?, ?, ?)',
+                        (task_id, task['version'], json.dumps(list(fields))))
+        return task
+
+    def mark_done(self, task_id):
+        return self.update(task_id, {'done': True})
+
+    def delete(self, task_id, version=None):
+        task = self.get(task_id)
+        where, params = self.where_version(task_id, version)
+        if not self.db.execute(f'DELETE FROM tasks WHERE {where}', params).rowcount:
+            raise self.conflict(task_id)
+        self.db.execute('DELETE FROM task_tags WHERE task_id = ?', (task_id,))
+        self.db.execute('DELETE FROM task_changes WHERE task_id = ?', (task_id,))
+        return task
+
+    def delete_many(self, task_ids):
+        tasks = [task for task in map(self.get, dict.fromkeys(task_ids)) if task]
+        rows = [(task['id'],) for task in tasks]
+        self.db.executemany('DELETE FROM tasks WHERE id = ?', rows)
+        self.db.executemany('DELETE FROM task_tags WHERE task_id = ?', rows)
+        self.db.executemany('DELETE FROM task_changes WHERE task_id = ?', rows)
+        return tasks
+
+    # Each order has an index ending in pos, so ORDER BY reads the index in order
+    def sorted_tasks(self, order, reverse=False):
+        direction = ' DESC' if reverse else ''
+        columns = SORT_COLUMNS[order] + ['pos']
+        return self.query('ORDER BY ' + ', '.join(column + direction for column in columns))
+
+    def set_sort_order(self, order, reverse=False):
+        self.ensure_loaded()
+        self.sort_order = [order, reverse]
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('sort', ?)", (json.dumps(self.sort_order),))
+        self.db.commit()
+
+    def view_tasks(self):
+        self.ensure_loaded()
+        if self.sort_order:
+            return self.sorted_tasks(*self.sort_order)
+        return self.iter_tasks()
+
+    # The whole query becomes one WHERE clause and SQLite's planner picks the
+    # index. Words use the FTS5 table when this SQLite has it, ranked with
+    # bm25 (title counts twice), otherwise they are looked for with instr.
+    def find(self, conditions, limit=None):
+        self.ensure_loaded()
+        join, where, params, order = '', [], [], 'tasks.pos'
+        for field, op, value in conditions:
+            if field == 'text':
+                words = tokenize(value)
+                if not words:
+                    return iter(())
+                if self.fts:
+                    join = 'JOIN tasks_fts ON tasks_fts.rowid = tasks.rowid'
+                    where.append('tasks_fts MATCH ?')
+                    params.append(' AND '.join(f'"{word}"*' for word in words))
+                    order = 'bm25(tasks_fts, 2.0, 1.0)'
+                else:
+                    for word in words:
+                        where.append('(instr(lower(title), ?) > 0 OR instr(lower(description), ?) > 0)')
+                        params += [word, word]
+                continue
+            if field == 'tag':
+                # Answered from task_tags' (tag, task_id) key
+                if op == ':':
+                    where.append('tasks.id IN (SELECT task_id FROM task_tags WHERE instr(tag, ?) > 0)')
+                    params.append(value)
+                else:
+                    marks = ', '.join('?' * len(value))
+                    negate = 'NOT ' if op == '!=' else ''
+                    where.append(f'tasks.id {negate}IN (SELECT task_id FROM task_tags WHERE tag IN ({marks}))')
+                    params += value
+                continue
+            column = QUERY_COLUMNS[field]
+            if op == ':':
+                where.append(f'instr(lower(tasks.{column}), ?) > 0')
+            elif field == 'title':
+                where.append(f'tasks.{column} {op} ? COLLATE NOCASE')
+            else:
+                where.append(f'tasks.{column} {op} ?')
+            params.append(sql_value(field, value))
+
+        sql = f'SELECT tasks.* FROM tasks {join}'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY {order}'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return (row_to_task(row) for row in self.db.execute(sql, params))
+
+    def search(self, text, limit=None):
+        return list(self.find([('text', ':', text)], limit))
+
+    # The database is only read as far as needed anyway
+    def scan(self, conditions, limit=None):
+        return self.find(conditions, limit)
+
+    def count_due(self, first, last):
+        self.ensure_loaded()
+        rows = self.db.execute('SELECT COUNT(*) FROM tasks WHERE due_date BETWEEN ? AND ?',
+                               (first.strftime('%Y/%m/%d'), last.strftime('%Y/%m/%d')))
+        return rows.fetchone()[0]
+
+    # Dates are stored as zero padded YYYY/MM/DD, so text order is date order
+    # and each bucket is a range scan on idx_tasks_due_date
+    def due_counts(self, today=None):
+        today = today or date.today()
+        return {
+            'today': self.count_due(today, today),
+            'week': self.count_due(today + timedelta(days=1), today + timedelta(days=7)),
+            'month': self.count_due(today + timedelta(days=8), today + timedelta(days=30)),
+            'overdue': self.count_due(date.min, today - timedelta(days=1)),
+        }
+
+    # All counters in one query
+    def stats(self):
+        self.ensure_loaded()
+        stats = TaskStats()
+        row = self.db.execute('''
+            SELECT COUNT(*), COALESCE(SUM(done), 0),
+                   COALESCE(SUM(priority = 'high'), 0),
+                   COALESCE(SUM(priority = 'medium'), 0),
+                   COALESCE(SUM(priority = 'low'), 0)
+            FROM tasks''').fetchone()
+        stats.total, stats.done = row[0], row[1]
+        stats.priorities.update({'high': row[2], 'medium': row[3], 'low': row[4]})
+        return stats
+
+    # Read from task_tags' key, without looking at the tasks table
+    def tag_counts(self):
+        self.ensure_loaded()
+        rows = self.db.execute('SELECT tag, COUNT(*) FROM task_tags GROUP BY tag')
+        return Counter(dict(rows.fetchall()))
+
+    # Reads size rows at a time, so a big table never sits in memory at once
+    def chunks(self, size):
+        self.ensure_loaded()
+        rows = self.db.execute('SELECT * FROM tasks ORDER BY pos')
+        while True:
+            chunk = rows.fetchmany(size)
+            if not chunk:
+                return
+            yield [row_to_task(row) for row in chunk]
+
+    def __len__(self):
+        self.ensure_loaded()
+        return self.db.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+
+# Full text index kept in sync with the tasks table by triggers.
+# Returns False when this SQLite was built without FTS5.
+def create_fts(db):
+    try:
+        exists = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'tasks_fts'").fetchone()
+        db.executescript('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+                title, description, content='tasks', content_rowid='rowid', prefix='2 3');
+            CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+                INSERT INTO tasks_fts(rowid, title, description) VALUES (new.rowid, new.title, new.description);
+            END;
+            CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+                INSERT INTO tasks_fts(tasks_fts, rowid, title, description) VALUES ('delete', old.rowid, old.title, old.description);
+            END;
+            CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF title, description ON tasks BEGIN
+                INSERT INTO tasks_fts(tasks_fts, rowid, title, description) VALUES ('delete', old.rowid, old.title, old.description);
+                INSERT INTO tasks_fts(rowid, title, description) VALUES (new.rowid, new.title, new.description);
+            END;
+        ''')
+        if not exists:
+            db.execute("INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+# Copies tasks.json (and its journal) into an SQLite store in one transaction
+def migrate_json_to_sqlite(json_path=TASKS_FILE, sqlite_store=None):
+    if sqlite_store is None:
+        sqlite_store = SqliteStore(json_path=json_path)
+    json_store = TaskStore(json_path)
+    sqlite_store.add_many(json_store.all())
+    # Carry the ID counter over, so IDs of tasks deleted before the move aren't reused
+    sqlite_store.ids = make_id_allocator(json_store.ids.to_meta(), sqlite_store.id_mode)
+    sqlite_store.save_ids()
+    if json_store.sort_order:
+        sqlite_store.set_sort_order(*json_store.sort_order)
+    sqlite_store.db.execute("INSERT OR REPLACE INTO meta VALUES ('migrated', '1')")
+    sqlite_store.save()
+    return len(json_store)
+
+# Tasks split by due month: tasks/2025-01.json, tasks/2025-02.json... Each
+# month is a TaskStore of its own (its own journal, lock and indexes) that is
+# only loaded the first time it is needed and saved on its own, so working on
+# this month's tasks costs the same however many old months there are.
+# tasks/summary.json keeps the counts and tags of every month together with
+# the state of its files. While the files haven't changed the dashboard and
+# the query routing use those instead of loading the month:
+#   - due counts load only the months from today to 30 days ahead, anything
+#     earlier is overdue as a whole,
+#   - tag, priority and done filters skip the months without a match,
+#   - due date ranges only go to the months they cover.
+# The ID counter and the sort order are in tasks/shards.meta.json and the
+# month of every task ID in tasks/months.log (see MonthMap), both changed
+# while holding tasks/shards.lock. An ID is put in the map before the task is
+# written and taken out after it is deleted, so the map never misses a task
+# and finding one loads one month. A task whose due date moves to another month is added there before it is
+# removed from the old one, so a crash in between leaves a copy rather than
+# losing it.
+SHARDS_DIR = 'tasks'
+SHARD_FILE = re.compile(r'^(\d{4}-\d{2})\.(json|journal)$')
+
+def month_key(day_number):
+    day = date.fromordinal(day_number)
+    return f'{day.year:04d}-{day.month:02d}'
+
+# First and last day number of a 'YYYY-MM' month
+def month_span(key):
+    year, month = int(key[:4]), int(key[5:])
+    first = date(year, month, 1).toordinal()
+    following = date(year + month // 12, month % 12 + 1, 1).toordinal()
+    return first, following - 1
+
+# tasks/months.log: the month every task ID is in, as one ["id", "YYYY-MM"]
+# line per add or move and ["id", null] per delete. Lines are only appended
+# (holding the store's lock), so a change writes one line and a session reads
+# the file once and then only what other sessions added since. Once old lines
+# are most of it the file is written again with one line per task.
+class MonthMap:
+    def __init__(self, path):
+        self.path = path
+        self.months = {}
+        self.inode = None
+        self.offset = 0
+        self.lines = 0
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    # Catches up and returns id -> month. A last line still being written is
+    # left for the next read.
+    def read(self):
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            self.months, self.inode, self.offset, self.lines = {}, None, 0, 0
+            return self.months
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self.inode:
+                # Written again by another session, start over
+                self.months, self.inode, self.offset, self.lines = {}, inode, 0, 0
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end:
+            for task_id, key in json_loads(b'[' + data[:end - 1].replace(b'\n', b',') + b']'):
+                if key:
+                    self.months[task_id] = key
+                else:
+                    self.months.pop(task_id, None)
+            self.offset += end
+            self.lines += data.count(b'\n', 0, end)
+        return self.months
+
+    # months is id -> month, or None for a deleted task. Only called holding
+    # the lock. Adding a task doesn't need the map, so unless this session has
+    # read it already only the end of the file is looked at.
+    def write(self, months):
+        if self.inode is not None:
+            self.read()
+            if self.lines > 2 * len(self.months) + 1000:
+                self.rewrite()
+        data = ''.join(json_dumps([task_id, key]) + '\n' for task_id, key in months.items()).encode()
+        with open(self.path, 'a+b') as f:
+            # Cut off what a crashed session left half written
+            size = f.seek(0, os.SEEK_END)
+            start = max(0, size - 4096)
+            f.seek(start)
+            tail = f.read()
+            if tail and not tail.endswith(b'\n'):
+                f.truncate(start + tail.rfind(b'\n') + 1)
+            f.write(data)
+        if self.inode is not None:
+            self.read()
+
+    def rewrite(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(''.join(json_dumps([task_id, key]) + '\n' for task_id, key in self.months.items()).encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self.read()
+
+def shard_state(shard):
+    return [list(state) if state else None for state in (file_state(shard.path), file_state(shard.journal_path))]
+
+# What summary.json keeps of a loaded month
+def summarize(shard):
+    stats = shard.stats()
+    return {'total': stats.total, 'done': stats.done, 'priorities': dict(stats.priorities),
+            'tags': dict(shard.tag_counts())}
+
+class ShardedStore:
+    def __init__(self, folder=SHARDS_DIR, json_path=TASKS_FILE, id_mode=None):
+        self.folder = folder
+        self.json_path = json_path
+        self.id_mode = id_mode
+        self.meta_path = os.path.join(folder, 'shards.meta.json')
+        self.summary_path = os.path.join(folder, 'summary.json')
+        self.archive = Archive(os.path.join(folder, 'archive.jsonl.gz'))
+        self.month_map = MonthMap(os.path.join(folder, 'months.log'))
+        self.lock = FileLock(os.path.join(folder, 'shards.lock'))
+        self.shards = {}
+        self.summary = {}
+        self.states = {}
+        self.meta = {}
+        self.meta_state = None
+        # IDs this session got from new_ids() and hasn't added yet
+        self.allocated = set()
+        self.sort_order = None
+        self.loaded = False
+
+    # Only looks at which months there are, no month is loaded here
+    def load(self):
+        os.makedirs(self.folder, exist_ok=True)
+        with self.lock:
+            names = os.listdir(self.folder)
+            if not os.path.exists(self.meta_path) and not any(SHARD_FILE.match(name) for name in names):
+                migrate_json_to_shards(self.json_path, self)
+        self.shards = {}
+        self.loaded = True
+        self.refresh()
+        if not self.month_map.exists():
+            self.map_months()
+
+    # Folders from before months.log: every month is read through once to
+    # make it
+    def map_months(self):
+        with self.lock:
+            if self.month_map.exists():
+                return
+            meta = dict(self.read_meta())
+            ids = make_id_allocator(meta, self.id_mode)
+            months = meta.pop('months', None)
+            if months is None:
+                months = {}
+                for key in self.keys():
+                    for task in self.shards[key].stream():
+                        months[task.id] = key
+            for task_id in months:
+                ids.see(task_id)
+            self.write_meta({**meta, **ids.to_meta()})
+            self.month_map.write(months)
+
+    # shards.meta.json, read again only when another session changed it
+    def read_meta(self):
+        state = file_state(self.meta_path)
+        if state != self.meta_state:
+            self.meta = load_meta(self.meta_path)
+            self.meta_state = state
+        return self.meta
+
+    def write_meta(self, meta):
+        save_task(meta, self.meta_path)
+        self.meta, self.meta_state = meta, file_state(self.meta_path)
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    # Picks up months other sessions started and catches up the loaded ones.
+    # Returns the ids changed in the loaded months like TaskStore.refresh(),
+    # or None when a month that isn't loaded changed or a new one started.
+    def refresh(self, repair=False):
+        self.ensure_loaded()
+        for name in os.listdir(self.folder):
+            match = SHARD_FILE.match(name)
+            if match:
+                self.shard(match.group(1))
+        changed = []
+        for shard in self.loaded_shards():
+            ids = shard.refresh(repair)
+            changed = None if changed is None or ids is None else changed + ids
+        states = {key: shard_state(shard) for key, shard in self.shards.items() if not shard.loaded}
+        if any(self.states.get(key) != state for key, state in states.items()):
+            changed = None
+        self.states = states
+        self.summary = load_meta(self.summary_path)
+        self.sort_order = self.read_meta().get('sort')
+        return changed
+
+    def state(self):
+        self.ensure_loaded()
+        return sorted((entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                      for entry in os.scandir(self.folder))
+
+    def shard(self, key):
+        if key not in self.shards:
+            self.shards[key] = TaskStore(os.path.join(self.folder, key + '.json'))
+        return self.shards[key]
+
+    def loaded_shards(self):
+        return [shard for shard in self.shards.values() if shard.loaded]
+
+    # Months in order, oldest first
+    def keys(self, reverse=False):
+        self.ensure_loaded()
+        return sorted(self.shards, reverse=reverse)
+
+    # The month's counts: live when it is loaded, from summary.json while its
+    # files are unchanged, else None
+    def summary_of(self, key):
+        shard = self.shards[key]
+        if shard.loaded:
+            return summarize(shard)
+        saved = self.summary.get(key)
+        if saved and saved['state'] == shard_state(shard):
+            return saved
+        return None
+
+    def save(self):
+        changed = {}
+        for key, shard in self.shards.items():
+            if shard.loaded:
+                shard.save()
+                with shard.lock:
+                    shard.refresh(repair=True)
+                    entry = {'state': shard_state(shard), **summarize(shard)}
+                if self.summary.get(key) != entry:
+                    changed[key] = entry
+        if changed:
+            with self.lock:
+                self.summary = {**load_meta(self.summary_path), **changed}
+                save_task(self.summary, self.summary_path)
+
+    def close(self):
+        self.save()
+        for shard in self.loaded_shards():
+            shard.close()
+
+    # One counter for all months, so IDs never repeat between them
+    def new_ids(self, count):
+        self.ensure_loaded()
+        with self.lock:
+            meta = self.read_meta()
+            ids = make_id_allocator(meta, self.id_mode)
+            new = ids.allocate(count)
+            self.write_meta({**meta, **ids.to_meta()})
+        self.allocated.update(new)
+        return new
+
+    def new_id(self):
+        return self.new_ids(1)[0]
+
+    # The month a task is in, only that month is loaded
+    def shard_of(self, task_id):
+        self.ensure_loaded()
+        key = self.month_map.read().get(task_id)
+        if key is None:
+            return None
+        shard = self.shard(key)
+        return shard if task_id in shard else None
+
+    def get(self, task_id):
+        shard = self.shard_of(task_id)
+        return shard.get(task_id) if shard else None
+
+    def __contains__(self, task_id):
+        return self.shard_of(task_id) is not None
+
+    def add(self, task):
+        return self.add_many([task])[0]
+
+    # An ID used in any month gets a new one from the shared counter, which
+    # then counts on from the highest ID stored. IDs from new_ids() are above
+    # all of those, so only the others have to be looked up.
+    def add_many(self, tasks):
+        self.ensure_loaded()
+        tasks = [Task(dict(t)) for t in tasks]
+        with self.lock:
+            meta = self.read_meta()
+            ids = make_id_allocator(meta, self.id_mode)
+            counter = ids.to_meta()
+            taken = self.month_map.read() if any(t.id not in self.allocated for t in tasks) else {}
+            months = {}
+            positions = {}
+            for i, task in enumerate(tasks):
+                if task.id in taken or task.id in months:
+                    task.id = ids.allocate(1)[0]
+                ids.see(task.id)
+                self.allocated.discard(task.id)
+                months[task.id] = month_key(task.due)
+                positions.setdefault(months[task.id], []).append(i)
+            if ids.to_meta() != counter:
+                self.write_meta({**meta, **ids.to_meta()})
+            self.month_map.write(months)
+            for key, group in positions.items():
+                added = self.shard(key).add_many([dict(tasks[i]) for i in group])
+                for i, task in zip(group, added):
+                    tasks[i] = task
+        return tasks
+
+    def checked_shard(self, task_id):
+        shard = self.shard_of(task_id)
+        if shard is None:
+            raise ConflictError(f'Task {task_id} was deleted in another session')
+        return shard
+
+    def update(self, task_id, fields, version=None):
+        shard = self.checked_shard(task_id)
+        task = shard.update(task_id, fields, version)
+        key = month_key(task.due)
+        if self.shard(key) is not shard:
+            with self.lock:
+                task = self.shard(key).add(dict(task))
+                self.month_map.write({task_id: key})
+                shard.delete(task_id)
+        return task
+
+    def mark_done(self, task_id):
+        return self.checked_shard(task_id).mark_done(task_id)
+
+    def delete(self, task_id, version=None):
+        with self.lock:
+            task = self.checked_shard(task_id).delete(task_id, version)
+            self.month_map.write({task_id: None})
+        return task
+
+    def delete_many(self, task_ids):
+        self.ensure_loaded()
+        months = {}
+        for task_id in dict.fromkeys(task_ids):
+            shard = self.shard_of(task_id)
+            if shard:
+                months.setdefault(shard, []).append(task_id)
+        tasks = [task for shard, ids in months.items() for task in shard.delete_many(ids)]
+        if tasks:
+            with self.lock:
+                self.month_map.write(dict.fromkeys((task.id for task in tasks), None))
+        return tasks
+
+    def iter_tasks(self):
+        return (task for key in self.keys() for task in self.shards[key].iter_tasks())
+
+    def all(self):
+        return list(self.iter_tasks())
+
+    def chunks(self, size):
+        tasks = self.iter_tasks()
+        while chunk := list(islice(tasks, size)):
+            yield chunk
+
+    # Every month is already sorted, they only have to be merged
+    def sorted_tasks(self, order, reverse=False):
+        keys = self.keys()
+        if not keys:
+            return iter(())
+        entry = self.shards[keys[0]].index(order).entry
+        return heapq.merge(*(self.shards[key].sorted_tasks(order, reverse) for key in keys),
+                           key=entry, reverse=reverse)
+
+    def set_sort_order(self, order, reverse=False):
+        self.ensure_loaded()
+        with self.lock:
+            meta = dict(self.read_meta())
+            meta['sort'] = self.sort_order = [order, reverse]
+            self.write_meta(meta)
+
+    def view_tasks(self):
+        self.ensure_loaded()
+        if self.sort_order:
+            return self.sorted_tasks(*self.sort_order)
+        return self.iter_tasks()
+
+    # Months that can have tasks matching all the conditions, see the top
+    def relevant_keys(self, conditions):
+        due = query_range(conditions, 'due')
+        keys = []
+        for key in self.keys():
+            first, last = month_span(key)
+            if due and (last < due[0] or first >= due[1]):
+                continue
+            summary = self.summary_of(key)
+            if summary and not self.may_match(summary, conditions):
+                continue
+            keys.append(key)
+        return keys
+
+    @staticmethod
+    def may_match(summary, conditions):
+        for field, op, value in conditions:
+            if field == 'tag' and op == '=' and not any(tag in summary['tags'] for tag in value):
+                return False
+            if field == 'priority' and op == '=' and not summary['priorities'].get(PRIORITIES[value]):
+                return False
+            if field == 'done' and op == '=' and not (summary['done'] if value else summary['total'] - summary['done']):
+                return False
+        return True
+
+    # Each month answers with its own indexes. Text searches score across all
+    # the months that can match, like one store would (see scan_search()).
+    def find(self, conditions, limit=None):
+        self.ensure_loaded()
+        for field, op, value in conditions:
+            if field == 'id' and op == '=':
+                shard = self.shard_of(value)
+                return shard.find(conditions, limit) if shard else iter(())
+        keys = self.relevant_keys(conditions)
+        words = ' '.join(value for field, op, value in conditions if field == 'text')
+        if words:
+            checks = [c for c in conditions if c[0] != 'text']
+            tasks = [task for key in keys for task in self.shards[key].iter_tasks()]
+            return iter(scan_search(tasks, words, checks, limit))
+        return islice((task for key in keys for task in self.shards[key].find(conditions)), limit)
+
+    def search(self, text, limit=None):
+        return list(self.find([('text', ':', text)], limit))
+
+    def scan(self, conditions, limit=None):
+        return self.find(conditions, limit)
+
+    # Only the months from today to 30 days ahead are loaded, the ones before
+    # are overdue as a whole and later ones don't count
+    def due_counts(self, today=None):
+        today = today or date.today()
+        day = today.toordinal()
+        counts = Counter(today=0, week=0, month=0, overdue=0)
+        for key in self.keys():
+            first, last = month_span(key)
+            if first > day + 30:
+                continue
+            summary = self.summary_of(key) if last < day else None
+            if summary:
+                counts['overdue'] += summary['total']
+            else:
+                counts.update(self.shards[key].due_counts(today))
+        return dict(counts)
+
+    def stats(self):
+        stats = TaskStats()
+        for key in self.keys():
+            summary = self.summary_of(key) or summarize(self.shards[key])
+            stats.total += summary['total']
+            stats.done += summary['done']
+            stats.priorities.update(summary['priorities'])
+        return stats
+
+    def tag_counts(self):
+        counts = Counter()
+        for key in self.keys():
+            counts.update((self.summary_of(key) or summarize(self.shards[key]))['tags'])
+        return counts
+
+    def __len__(self):
+        return self.stats().total
+
+# Splits tasks.json (and its journal) into months, the first time the sharded
+# store is used. Called holding the store's lock.
+def migrate_json_to_shards(json_path, sharded):
+    if not os.path.exists(json_path) and not os.path.exists(journal_path(json_path)):
+        return 0
+    json_store = TaskStore(json_path)
+    months = {}
+    for task in json_store.all():
+        months.setdefault(month_key(task.due), []).append(task)
+    for key, tasks in months.items():
+        save_task(tasks, os.path.join(sharded.folder, key + '.json'))
+    sharded.write_meta({**json_store.ids.to_meta(), 'sort': json_store.sort_order})
+    sharded.month_map.write({task.id: key for key, tasks in months.items() for task in tasks})
+    return len(json_store)
+
+# Archive tier: done tasks due more than ARCHIVE_DAYS days ago (TASKS_ARCHIVE_DAYS,
+# or archive --days) are moved out of the store into an archive next to it
+# (tasks.archive.jsonl.gz, tasks.db.archive.jsonl.gz, tasks/archive.jsonl.gz),
+# so screens, searches and sorts only go through the tasks still in use.
+# Every run appends its tasks as one more gzip member, nothing already
+# archived is rewritten. tasks.archive.json keeps the counts the dashboard
+# needs (like summary.json does for a month of the sharded store), so
+# statistics still include archived tasks without reading them. Searching
+# the archive reads it through on demand (search --archived).
+ARCHIVE_DAYS = int(os.environ.get('TASKS_ARCHIVE_DAYS', 30))
+
+class Archive:
+    def __init__(self, path):
+        self.path = path
+        base = path.removesuffix('.jsonl.gz')
+        self.summary_path = base + '.json'
+        self.lock = FileLock(base + '.lock')
+
+    # bytes is how much of the file the counts cover. If the counts are lost
+    # they are made again from the archive.
+    def summary(self):
+        if self.exists() and not os.path.exists(self.summary_path):
+            with self.lock:
+                if not os.path.exists(self.summary_path):
+                    save_task(self.count_archived(), self.summary_path)
+        return {'bytes': 0, 'total': 0, 'done': 0, 'priorities': {}, 'tags': {}, **load_meta(self.summary_path)}
+
+    # The counts of every whole gzip member, bytes is where the last one ends
+    def count_archived(self):
+        with open(self.path, 'rb') as f:
+            data = memoryview(f.read())
+        stats, tags, end = TaskStats(), Counter(), 0
+        while end < len(data):
+            member = zlib.decompressobj(31)
+            try:
+                lines = member.decompress(data[end:])
+            except zlib.error:
+                break
+            if not member.eof:
+                break
+            end = len(data) - len(member.unused_data)
+            for line in lines.splitlines():
+                task = Task(json_loads(line))
+                stats.add(task)
+                tags.update(task.tags)
+        return {'bytes': end, 'total': stats.total, 'done': stats.done,
+                'priorities': dict(stats.priorities), 'tags': dict(tags)}
 
-def load_task():
+    def exists(self):
+        return os.path.exists(self.path)
+
+    # Archived tasks one at a time, in the order they were archived. A run
+    # cut off while writing leaves an unfinished member at the end, reading
+    # stops there.
+    def iter_tasks(self):
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f, gzip.GzipFile(fileobj=f) as lines:
+            try:
+                for line in lines:
+                    yield Task(json_loads(line))
+            except (EOFError, gzip.BadGzipFile):
+                return
+            finally:
+                if metrics:
+                    metrics.count('archive bytes read', f.tell())
+
+    def scan(self, conditions, limit=None):
+        return scan_tasks(self.iter_tasks(), conditions, limit)
+
+    def append(self, tasks):
+        with open(self.path, 'ab') as f:
+            # zlib's usual level, 9 is several times slower for a few percent
+            with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6) as out:
+                for start in range(0, len(tasks), EXPORT_CHUNK):
+                    out.write(''.join(json_dumps(t) + '\n' for t in tasks[start:start + EXPORT_CHUNK]).encode())
+            f.flush()
+            os.fsync(f.fileno())
+            if metrics:
+                metrics.count('archive bytes written', f.tell())
+                metrics.count('archive records written', len(tasks))
+
+    # Moves the done tasks of store due before today - days into the archive
+    # and returns how many there were. The counts are saved after the tasks
+    # are written and before they are deleted from the store: an end the
+    # counts don't cover is from a run that stopped before saving them and is
+    # cut off (its tasks are still in the store), and the ids saved as
+    # pending are tasks already archived that a run stopped before deleting.
+    def move(self, store, days=ARCHIVE_DAYS, today=None):
+        cutoff = (today or date.today()) - timedelta(days=days)
+        with self.lock:
+            summary = self.summary()
+            if self.exists() and os.path.getsize(self.path) > summary['bytes']:
+                with open(self.path, 'r+b') as f:
+                    f.truncate(summary['bytes'])
+            if not os.path.exists(self.summary_path):
+                # Saved before the first write, so the counts are only ever
+                # missing when they were lost, never after a cut off first run
+                save_task(summary, self.summary_path)
+            pending = set(summary.pop('pending', ()))
+            # find(), not scan(): the store is loaded to delete them anyway
+            tasks = list(store.find(parse_query(f'done=true due<{cutoff:%Y/%m/%d}')))
+            new = [t for t in tasks if t['id'] not in pending]
+            if new:
+                self.append(new)
+                priorities, tags = Counter(summary['priorities']), Counter(summary['tags'])
+                priorities.update(t['priority'] for t in new)
+                for text, count in Counter(t['tag'] for t in new).items():
+                    tags.update(dict.fromkeys(split_tags(text), count))
+                summary.update(bytes=os.path.getsize(self.path), total=summary['total'] + len(new),
+                               done=summary['done'] + len(new), priorities=dict(priorities), tags=dict(tags))
+            summary['pending'] = [t['id'] for t in tasks]
+            save_task(summary, self.summary_path)
+            store.delete_many(summary['pending'])
+            store.save()
+            del summary['pending']
+            save_task(summary, self.summary_path)
+        return len(tasks)
+
+# Opt-in instrumentation, turned on with TASKS_METRICS=<file>. Store calls,
+# menu screens, commands, tasks.json / journal reads and writes and terminal
+# output are timed, and bytes and records counted. The totals of the session
+# are appended to the file as one JSON line every METRICS_EVERY seconds and
+# at exit; `stats --internal` adds up the last line of every session.
+# Without TASKS_METRICS nothing is wrapped and nothing costs anything.
+METRICS_FILE = os.environ.get('TASKS_METRICS')
+METRICS_EVERY = 60
+STORE_CALLS = ('load', 'refresh', 'save', 'compact', 'get', 'add_many', 'update', 'mark_done', 'delete',
+               'delete_many', 'iter_tasks', 'view_tasks', 'sorted_tasks', 'find', 'search', 'scan', 'stream', 'chunks',
+               'stats', 'due_counts', 'tag_counts')
+
+# Latency histogram, bucket b counts the calls that took under 2**b microseconds
+class Histogram:
+    def __init__(self, data=None):
+        data = data or {}
+        self.count = data.get('count', 0)
+        self.total = data.get('total', 0.0)
+        self.max = data.get('max', 0.0)
+        self.buckets = Counter({int(b): n for b, n in data.get('buckets', {}).items()})
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[int(seconds * 1e6).bit_length()] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.buckets.update(other.buckets)
+
+    # Upper bound of the bucket the p-th percentile falls in, in seconds
+    def percentile(self, p):
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= self.count * p / 100:
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'max': self.max, 'buckets': dict(self.buckets)}
+
+class Metrics:
+    def __init__(self, path):
+        self.path = path
+        self.session = f'{os.getpid()}-{int(time.time())}'
+        self.timings = {}
+        self.counters = Counter()
+        self.last_dump = time.monotonic()
+
+    def record(self, name, seconds):
+        if name not in self.timings:
+            self.timings[name] = Histogram()
+        self.timings[name].add(seconds)
+        if time.monotonic() - self.last_dump >= METRICS_EVERY:
+            self.dump()
+
+    def count(self, name, amount):
+        self.counters[name] += amount
+
+    # Appends the session's totals so far, every line has all of them
+    def dump(self):
+        self.last_dump = time.monotonic()
+        line = json.dumps({
+            'session': self.session,
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'timings': {name: h.to_dict() for name, h in self.timings.items()},
+            'counters': self.counters,
+        })
+        with open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+metrics = Metrics(METRICS_FILE) if METRICS_FILE else None
+
+# Wraps func so every call is timed under name. Lists that come back are
+# counted as records; generators are wrapped too, so the time spent going
+# through them (where the work of find() and the sorted views happens) is
+# timed as "<name> iterate".
+def measured(name, func):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            metrics.record(name, time.perf_counter() - start)
+        if isinstance(result, list):
+            metrics.count(name + ' records', len(result))
+        elif hasattr(result, '__next__'):
+            return measured_iter(name, result)
+        return result
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+def measured_iter(name, items):
+    taken = 0
+    spent = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                break
+            finally:
+                spent += time.perf_counter() - start
+            taken += 1
+            yield item
+    finally:
+        metrics.record(name + ' iterate', spent)
+        metrics.count(name + ' records', taken)
+
+# Stands in for sys.stdout and times everything printed
+class MeasuredOutput:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        start = time.perf_counter()
+        written = self.stream.write(text)
+        metrics.record('terminal write', time.perf_counter() - start)
+        metrics.count('terminal bytes written', len(text.encode(errors='replace')))
+        return written
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def instrument(store):
+    name = type(store).__name__
+    for call in STORE_CALLS:
+        if hasattr(store, call):
+            setattr(store, call, measured(f'{name}.{call}', getattr(store, call)))
+    return store
+
+if metrics:
+    load_task = measured('load_task', load_task)
+    save_task = measured('save_task', save_task)
+    read_journal = measured('read_journal', read_journal)
+    sys.stdout = MeasuredOutput(sys.stdout)
+    atexit.register(metrics.dump)
+
+# The last line of every session in the metrics file, added up
+def read_metrics(path):
+    sessions = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            sessions[data['session']] = data
+    timings = {}
+    counters = Counter()
+    for data in sessions.values():
+        for name, h in data['timings'].items():
+            timings.setdefault(name, Histogram()).merge(Histogram(h))
+        counters.update(data['counters'])
+    return len(sessions), timings, counters
+
+def internal_stats_screen(path):
     try:
-        with open('tasks.json', 'r') as f:
-            return json.load(f)
+        sessions, timings, counters = read_metrics(path)
     except FileNotFoundError:
-        return []
+        raise ValueError(f'No metrics in {path} yet, run with TASKS_METRICS={path} first')
+    print('''
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+|     INTERNAL STATISTICS     |
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+''')
+    print(f'Sessions: {sessions}')
+    print('\n||━━━━━ TIMINGS (ms) ━━━━━||\n')
+    print(f'{"Name":32} {"Calls":>8} {"Total":>10} {"Mean":>9} {"p50":>9} {"p95":>9} {"p99":>9} {"Max":>9}')
+    for name, h in sorted(timings.items(), key=lambda item: -item[1].total):
+        ms = [x * 1000 for x in (h.total, h.total / h.count, h.percentile(50), h.percentile(95), h.percentile(99), h.max)]
+        print(f'{name:32} {h.count:8} {ms[0]:10.1f} ' + ' '.join(f'{x:9.3f}' for x in ms[1:]))
+    print('\n||━━━━━ COUNTERS ━━━━━||\n')
+    for name, value in sorted(counters.items()):
+        print(f'{name:40} {value}')
+
+BACKENDS = {'json': TaskStore, 'sqlite': SqliteStore, 'shards': ShardedStore}
 
-def save_task(tasks):
-    with open('tasks.json','w') as f:
-        json.dump(tasks, f, indent=3)
+# Pick the storage with TASKS_BACKEND=json (default), sqlite or shards
+def open_store(backend=None):
+    backend = backend or os.environ.get('TASKS_BACKEND', 'json')
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend: {backend}. Choose from {", ".join(BACKENDS)}')
+    store = BACKENDS[backend]()
+    return instrument(store) if metrics else store
+
+store = open_store()
+
+# Short stop after each screen so the result can be read. Command mode sets it to 0.
+PAUSE = 1
+
+def pause():
+    if PAUSE:
+        time.sleep(PAUSE)
 
 # Helper funcs for add_task() and update_task(): 1 - get_valid_date 2 - get-valid_priority 3 - get_input 4 - get_tag
+VALID_PRIORITIES = ['high','medium','low']
+
+# Returns the date zero padded (2008/8/13 -> 2008/08/13), or None if it isn't YYYY/MM/DD.
+# Plain digits are checked without strptime, which is slow for bulk imports.
+def valid_date(date):
+    parts = date.split('/')
+    if len(parts) == 3 and all(p.isdecimal() for p in parts) and \
+            len(parts[0]) == 4 and len(parts[1]) <= 2 and len(parts[2]) <= 2:
+        try:
+            return f'{datetime(int(parts[0]), int(parts[1]), int(parts[2])):%Y/%m/%d}'
+        except ValueError:
+            return None
+    try:
+        return datetime.strptime(date,'%Y/%m/%d').strftime('%Y/%m/%d')
+    except ValueError:
+        return None
+
+def valid_priority(priority):
+    priority = priority.strip().lower()
+    return priority if priority in VALID_PRIORITIES else None
+
 def get_valid_date(prompt):
     while True:
-        date = input(prompt).strip()
-        try:
-            datetime.strptime(date,'%Y/%m/%d')
+        date = valid_date(input(prompt).strip())
+        if date:
             return date
-        except ValueError:
-            print('\n❌ Error: Invalid date! User fromat YYYY/MM/DD. Example: 2008/08/13.')
+        print('\n❌ Error: Invalid date! User fromat YYYY/MM/DD. Example: 2008/08/13.')
 
 def get_valid_priority(prompt):
-    valid_priorities = ['high','medium','low']
     while True:
-        user_input = input(prompt).strip().lower()
-        if user_input in valid_priorities:
+        user_input = valid_priority(input(prompt))
+        if user_input:
             return user_input
         print('\n❌ Error: Invalid priority! Choose high/medium/low.')
 
@@ -46,8 +2920,18 @@ def get_input(prompt, error_msg):
             return user_input
         print(error_msg)
 
+def new_task(title, description, priority, due_date, tag):
+    return {
+        'id': store.new_id(),
+        'title': title.title(),
+        'priority': priority,
+        'due date': due_date,
+        'done': False,
+        'description': description,
+        'tag': tag
+            }
+
 def add_task():
-    tasks = load_task()
     print('''
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 |          NEW TASK           |
@@ -59,22 +2943,11 @@ def add_task():
     priority = get_valid_priority("\nEnter priority (low/medium/high): ")
     due_date = get_valid_date("\nEnter due date (YYYY/MM/DD): ")
     tag = get_input('\nEnter tags i.e, gaming, study, sports: ','\n❌ Tags cannot be empty!')
-    task_id = str(random.randint(10000000, 999999999))
 
-    task = {
-        'id': task_id,
-        'title': title.title(),
-        'priority': priority,
-        'due date': due_date,
-        'done': False,
-        'description': description,
-        'tag': tag
-            }
-    
-    tasks.append(task)
-    save_task(tasks)
-    print(f'\n✅ - Task :[{title.title()}] saved with ID: {task_id}')
-    time.sleep(1)
+    task = store.add(new_task(title, description, priority, due_date, tag))
+    store.save()
+    print(f"\n✅ - Task :[{task['title']}] saved with ID: {task['id']}")
+    pause()
 
 def delete_task():
     print('''
@@ -83,19 +2956,25 @@ def delete_task():
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 ''')
 
-    tasks= load_task()
     while True:
         id_check = input('\nEnter ID to delete task: ')
         if id_check == '0':
             print('\n🛑 - Stopped deleting!')
             break
-        for dict in tasks:
-            if dict['id'] == id_check:
+        task = store.get(id_check)
+        if task:
+            # Another session may change it while we ask
+            version = task['version']
+            while True:
                 confirm = input('\nAre you sure (y/n): ').strip().lower()
                 if confirm == 'y':
-                    tasks.remove(dict)
-                    save_task(tasks)
-                    print(f'\n✅ Task: [{dict['title'].title()}] was removed!')
+                    try:
+                        store.delete(id_check, version)
+                    except ConflictError as e:
+                        print(f'\n❌ - Error: {e}!')
+                        return
+                    store.save()
+                    print(f"\n✅ Task: [{task['title'].title()}] was removed!")
                     return
                 elif confirm == 'n':
                     print('\n🛑 - Stopped deleting!!')
@@ -103,7 +2982,7 @@ def delete_task():
                 else:
                     print('\n❌ - Error: Enter (y / n)!')
         print('\n❌ - Error: Id does not match!')
-    time.sleep(1)
+    pause()
 
 def mark_task():
     print('''
@@ -112,23 +2991,54 @@ def mark_task():
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 ''')
 
-    tasks= load_task()
     while True:
         id_check = input('\nEnter ID to mark done: ')
         if id_check == '0':
             print('\n🛑 - Stopped marking down!')
             break
-        for dict in tasks:
-            if dict['id'] == id_check:
-                if dict['done'] == True:
-                    print(f'\n🛑 - Task: [{dict['title'].title()}] is already marked as done!')
-                    return
-                dict['done'] = True
-                save_task(tasks)
-                print(f'\n✅ Task: [{dict['title'].title()}] marked done!')
+        task = store.get(id_check)
+        if task:
+            if task['done'] == True:
+                print(f"\n🛑 - Task: [{task['title'].title()}] is already marked as done!")
                 return
+            try:
+                store.mark_done(id_check)
+            except ConflictError as e:
+                print(f'\n❌ - Error: {e}!')
+                return
+            store.save()
+            print(f"\n✅ Task: [{task['title'].title()}] marked done!")
+            return
         print('\n❌ Error: Id does not match!')
-    time.sleep(1)
+    pause()
+
+TASK_HEADERS = f"{'ID':<10} {'Title':<15} {'Priority':<10} {'Due Date':<15} {'Done':<5} {'Tags':<15} {'Description'}"
+
+def format_task(t):
+    done = '✅' if t['done'] else '❌'
+    priority = '🔴' if t['priority'] == 'high' else '🟡' if t['priority'] == 'medium' else '🟢'
+    return f"{t['id']:<10} {t['title']:<15} {priority:<10} {t['due date']:<15} {done:<5} {t['tag']:<15} {t['description']}"
+
+# Rows per page on the list screens, change it with TASKS_PAGE_SIZE
+PAGE_SIZE = int(os.environ.get('TASKS_PAGE_SIZE', 20))
+
+# Shows tasks one page at a time, each page in a single write. Only the page
+# on screen and the next one are pulled from tasks, so the first page of a huge
+# list shows up right away. Returns how many tasks were shown.
+def show_pages(tasks, headers=TASK_HEADERS, row=format_task, page_size=None):
+    page_size = page_size or PAGE_SIZE
+    tasks = iter(tasks)
+    print(headers)
+    print('-'*95)
+    shown = 0
+    page = list(islice(tasks, page_size))
+    while page:
+        sys.stdout.write('\n'.join(row(t) for t in page) + '\n')
+        shown += len(page)
+        page = list(islice(tasks, page_size))
+        if page and input(f'\n-- {shown} shown, Enter for more, q to stop: ').strip().lower() == 'q':
+            break
+    return shown
 
 def view_all_tasks():
     print('''
@@ -137,22 +3047,9 @@ def view_all_tasks():
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 ''')
 
-    tasks = load_task()
-    all_tasks = [t for t in tasks]
-  
-    headers = f'{'ID':<10} {'Title':<15} {'Priority':<10} {'Due Date':<15} {'Done':<5} {'Tags':<15} {'Description'}'
-
-    print(headers)
-    print('-'*95)  
-    
-    if all_tasks:
-        for t in all_tasks:
-            done = '✅' if t['done'] else '❌'
-            priority = '🔴' if t['priority'] == 'high' else '🟡' if t['priority'] == 'medium' else '🟢'
-            print(f"{t['id']:<10} {t['title']:<15} {priority:<10} {t['due date']:<15} {done:<5} {t['tag']:<15} {t['description']}")
-    else:
+    if not show_pages(store.view_tasks()):
         print("🛑 - No task created yet!")
-    time.sleep(1)
+    pause()
 
 def update_task():
     print('''
@@ -161,22 +3058,19 @@ def update_task():
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 ''')
 
-    tasks = load_task()
     while True:
         id_check = input('\nEnter ID to update: ')
         if id_check == '0':
             print('\n🛑 - Updating was stopped!')
             break
 
-        task_to_update = None
-        for t in tasks:
-            if t['id'] == id_check:
-                task_to_update = t
-                break
+        task_to_update = store.get(id_check)
         
         if not task_to_update:
             print('\n❌ - Error: ID does not exist!')
             continue
+        # Another session may change the task while we ask, see TaskStore.update()
+        version = task_to_update['version']
 
         print('\n1. Update title')
         print('2. Update description')
@@ -186,37 +3080,40 @@ def update_task():
 
         user_input = input('\nEnter (1 - 4): ')
 
-        if user_input == '1':
-            new_title = get_input("\nEnter the new task title: ", "\n❌ Title cannot be empty!")
-            task_to_update['title'] = new_title
-            print(f'\n✅ - New title: [{new_title.title()}] updated!')
-            
-        elif user_input == '2':
-            new_description = get_input("\nEnter description: ", "\n❌ Description cannot be empty!")
-            task_to_update['description'] = new_description
-            print(f'\n✅ - New description: [{new_description}] updated!')
-        
-        elif user_input == '3':
-            new_priority = get_valid_priority("\nEnter priority (low/medium/high): ")
-            task_to_update['priority'] = new_priority
-            print(f'\n✅ New priority: [{new_priority}] updated!')
-
-        elif user_input == '4':
-            new_due_date = get_valid_date("\nEnter due date (YYYY/MM/DD): ")
-            task_to_update['due date'] = new_due_date
-            print(f'\n✅ New due date: [{new_due_date}] updated!')
-            
-        elif user_input == '5':
-            new_tag = get_input('\nEnter new tag: ', '\n❌ Tag cannot be empty!')
-            task_to_update['tag'] = new_tag
-            print(f'\n✅ New tag: [{new_tag}] updated')
+        try:
+            if user_input == '1':
+                new_title = get_input("\nEnter the new task title: ", "\n❌ Title cannot be empty!")
+                store.update(id_check, {'title': new_title}, version)
+                print(f'\n✅ - New title: [{new_title.title()}] updated!')
+                
+            elif user_input == '2':
+                new_description = get_input("\nEnter description: ", "\n❌ Description cannot be empty!")
+                store.update(id_check, {'description': new_description}, version)
+                print(f'\n✅ - New description: [{new_description}] updated!')
             
-        else:
-            print('\n❌ - Error: Enter (1 - 4) or 0 to stop!')
+            elif user_input == '3':
+                new_priority = get_valid_priority("\nEnter priority (low/medium/high): ")
+                store.update(id_check, {'priority': new_priority}, version)
+                print(f'\n✅ New priority: [{new_priority}] updated!')
+
+            elif user_input == '4':
+                new_due_date = get_valid_date("\nEnter due date (YYYY/MM/DD): ")
+                store.update(id_check, {'due date': new_due_date}, version)
+                print(f'\n✅ New due date: [{new_due_date}] updated!')
+                
+            elif user_input == '5':
+                new_tag = get_input('\nEnter new tags i.e, gaming, study: ', '\n❌ Tag cannot be empty!')
+                store.update(id_check, {'tag': new_tag}, version)
+                print(f'\n✅ New tag: [{new_tag}] updated')
+                
+            else:
+                print('\n❌ - Error: Enter (1 - 4) or 0 to stop!')
+        except ConflictError as e:
+            print(f'\n❌ - Error: {e}!')
 
-        save_task(tasks)
+        store.save()
         break
-    time.sleep(1)
+    pause()
 
 def filter_by_priority():
     print('''
@@ -225,10 +3122,6 @@ def filter_by_priority():
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 ''')
     
-    tasks = load_task()
-
-    headers = f'{'ID':<10} {'Title':<15} {'Priority':<10} {'Due Date':<15} {'Done':<5} {'Tags':<15} {'Description'}'
-
     while True: 
         priority = input('\nEnter (high / medium / low): ').lower()
 
@@ -236,22 +3129,13 @@ def filter_by_priority():
             print('\n🛑 - Filtering Stopped!')
             break
 
-        pri_tasks = [t for t in tasks if t['priority'] == priority]
-
         if priority in ['high', 'medium', 'low']:
-            print(headers)
-            print("-" * 95)
-            if pri_tasks:
-                for t in pri_tasks:
-                    done = '✅' if t['done'] else '❌'
-                    priority = '🔴' if t['priority'] == 'high' else '🟡' if t['priority'] == 'medium' else '🟢'
-                    print(f"{t['id']:<10} {t['title']:<15} {priority:<10} {t['due date']:<15} {done:<5} {t['tag']:<15} {t['description']}")
-            else:
+            if not show_pages(store.find([('priority', '=', PRIORITIES.index(priority))])):
                 print(f"🛑 - No task is prioritized as {priority.lower()} yet!")
             break
         else:
             print('\n❌ - Error: Enter (high / medium / low)!')
-    time.sleep(1)
+    pause()
 
 def filter_by_tag():
     print('''
@@ -260,10 +3144,7 @@ def filter_by_tag():
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 ''')
     
-    tasks = load_task()
-
-    headers = f'{'ID':<10} {'Title':<15} {'Priority':<10} {'Due Date':<15} {'Done':<5} {'Tags':<15} {'Description'}'
-
+    print('One tag, or several: a, b for any of them, a + b for all of them')
     while True:
         tag = input('\nEnter the tag: ').lower()
 
@@ -271,19 +3152,12 @@ def filter_by_tag():
             print('\n🛑 - Filtering stopped!')
             break
 
-        tasks_tag = [t for t in tasks if tag in t['tag']]
-
-        print(headers)
-        print('-' * 95)
-        if tasks_tag:
-            for t in tasks_tag:
-                done = '✅' if t['done'] else '❌'
-                priority = '🔴' if t['priority'] == 'high' else '🟡' if t['priority'] == 'medium' else '🟢'
-                print(f"{t['id']:<10} {t['title']:<15} {priority:<10} {t['due date']:<15} {done:<5} {t['tag']:<15} {t['description']}")
+        groups = [split_tags(part) for part in tag.split('+')]
+        if all(groups) and show_pages(store.find([('tag', '=', tags) for tags in groups])):
             break
         else:
             print(f'\n❌ - Error: No such tag as [{tag.lower()}]')
-    time.sleep(1)
+    pause()
 
 def filter_by_done():
     print('''
@@ -292,10 +3166,6 @@ def filter_by_done():
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 ''')
     
-    tasks = load_task()
-
-    headers = f'{'ID':<10} {'Title':<15} {'Priority':<10} {'Due Date':<15} {'Done':<5} {'Tags':<15} {'Description'}'
-
     while True:
         status = input('\nEnter status (true / false): ').lower()
 
@@ -311,21 +3181,17 @@ def filter_by_done():
             print('\n❌ - Error: Enter (true / false)!')
             continue
 
-        task_status = [t for t in tasks if t['done'] == status]
-
-        print(headers)
-        print('-' * 95)
-        if task_status:
-            for t in task_status:
-                done = '✅' if t['done'] else '❌'
-                priority = '🔴' if t['priority'] == 'high' else '🟡' if t['priority'] == 'medium' else '🟢'
-                print(f"{t['id']:<10} {t['title']:<15} {priority:<10} {t['due date']:<15} {done:<5} {t['tag']:<15} {t['description']}")
+        if show_pages(store.find([('done', '=', status)])):
             break
         else:
             print(f'\n❌ - Error: No task avaliable!')
             break
-    time.sleep(1)
+    pause()
+
+# Most results the search command shows, best matches first
+SEARCH_LIMIT = 50
 
+# Takes words to search for and/or a query, see parse_query()
 def search_task():
     print('''
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -333,38 +3199,28 @@ def search_task():
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 ''')
     
-    tasks = load_task()
-    
+    print('Words from title or description, and/or filters like')
+    print('priority=high done=false tag=study due<2025/01/01 "some words"')
     while True:
-        search = input('\nEnter some words from title or description: ')
-        all_matchings = [t for t in tasks if search in t['title'] or search in t['description']]
+        search = input('\nSearch: ')
+        try:
+            conditions = parse_query(search)
+        except ValueError as e:
+            print(f'\n❌ Error: {e}')
+            break
 
-        headers = f'{'ID':<10} {'Title':<15} {'Priority':<12} {'Due Date':<15} {'Description'}'
         print('\n')
-        print(headers)
-        print('-'*95)
-        if all_matchings:
-            for t in all_matchings:
-                print(f'{t['id']:<10} {t['title']:<15} {t['priority']:<12} {t['due date']:<15} {t['description']}')
+        found = show_pages(store.find(conditions))
+        if store.archive.exists() and input('\nSearch archived tasks too (y/n): ').strip().lower() == 'y':
+            print('\n')
+            found += show_pages(store.archive.scan(conditions))
+        if found:
             return
         print('\n🛑 - Error: No result found!')    
         break
-    time.sleep(1)
+    pause()
             
 # Helpers for sort_tasks()
-def sort_by_title(tasks, reverse=False):
-    tasks.sort(key=lambda t: t['title'].lower(), reverse=reverse)
-
-def sort_by_priority(tasks, reverse=False):
-    priority_order = {'high': 1, 'medium': 2, 'low': 3}
-    tasks.sort(key=lambda t: priority_order[t['priority']], reverse=reverse)
-
-def sort_by_due_date(tasks, reverse=False):
-    tasks.sort(key=lambda t: t['due date'], reverse=reverse)
-
-def sort_by_done(tasks, reverse=False):
-    tasks.sort(key=lambda t: t['done'], reverse=reverse)            
-
 def get_order(prompt='Enter (1 = Ascending / 2 = Descending): '):
     while True:
         order = input(prompt)
@@ -372,6 +3228,8 @@ def get_order(prompt='Enter (1 = Ascending / 2 = Descending): '):
             return order == '2'  # True if descending
         print('\n❌ - Enter (1 / 2)!')
 
+# The chosen order is read from an index that is kept sorted and remembered for
+# view_all_tasks(), so nothing is sorted or rewritten here.
 def sort_tasks():
     print('''
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -379,128 +3237,165 @@ def sort_tasks():
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 ''')
     
-    tasks = load_task()
     print('\n1. A - Z')
     print('2. Z - A')
-    print('3. By priority')
+    print('3. By priority (then due date)')
     print('4. By due date')
     print('5. Completed first or pending first')
 
     while True:
         sort_by = input('\nEnter (1 - 5): ')
         if sort_by == '1':
-            sort_by_title(tasks)
+            store.set_sort_order('title')
             print('\n✅ - Tasks sorted (A - Z)!')
 
         elif sort_by == '2':
-            sort_by_title(tasks, reverse=True)
+            store.set_sort_order('title', reverse=True)
             print('\n✅ - Tasks sorted (Z - A)!')
         
         elif sort_by == '3': 
             reverse = get_order('\nHigh -> Low (1). Low -> High (2): ')
-            sort_by_priority(tasks, reverse=reverse)
+            store.set_sort_order('priority', reverse=reverse)
             print('\n✅ - Tasks sorted by priority!')               
 
         elif sort_by == '4':
-            sort_by_due_date(tasks)
+            store.set_sort_order('due')
             print('\n✅ - Tasks sorted by due date!')
 
         elif sort_by == '5':  
             reverse = get_order('\nPending first -> 1. Completed first -> 2: ')
-            sort_by_done(tasks, reverse=reverse)
+            store.set_sort_order('done', reverse=reverse)
             print('\n✅ Tasks sorted by completion status!')
 
         else:
             print('\n❌ Error: Please enter (1 - 5)!')
+            break
 
-        save_task(tasks)
+        print()
+        show_pages(store.view_tasks())
         break
-    time.sleep(1)
+    pause()
 
 # Helper funcs for statistics_screen(): 1 - get_task_dues 2 - count_tags
-def get_task_dues():
-    tasks = load_task()
-
-    today = datetime.today().date()
-    week_later = today + timedelta(days=7)
-    month_later = today + timedelta(days=30)
+# The dashboard counts archived tasks too, from the archive's saved counts.
+# They were all due before today, so they are overdue.
+def total_stats():
+    stats, archived = store.stats(), store.archive.summary()
+    if not archived['total']:
+        return stats
+    total = TaskStats()
+    total.total = stats.total + archived['total']
+    total.done = stats.done + archived['done']
+    total.priorities = stats.priorities + Counter(archived['priorities'])
+    return total
 
-    tasks_due_today = []
-    tasks_due_this_week = []
-    tasks_due_this_month = []
-    tasks_overdue = []
+def total_due_counts():
+    dues = dict(store.due_counts())
+    dues['overdue'] += store.archive.summary()['total']
+    return dues
 
-    for t in tasks:
-        # Convert string to datetime object (real-time)
-        due_date = datetime.strptime(t['due date'], "%Y/%m/%d").date()
-        
-        if due_date == today:
-            tasks_due_today.append(t)
-        elif today < due_date <= week_later:
-            tasks_due_this_week.append(t)
-        elif today < due_date <= month_later:
-            tasks_due_this_month.append(t)
-        elif due_date < today:
-            tasks_overdue.append(t)
-
-    print(f'Due Today:      {len(tasks_due_today)}')
-    print(f'Due This Week:  {len(tasks_due_this_week)}')
-    print(f'Due This Month: {len(tasks_due_this_month)}')
-    print(f'OverDue:        {len(tasks_overdue)}')
+def total_tag_counts():
+    return store.tag_counts() + Counter(store.archive.summary()['tags'])
 
-def count_tags():
-    tasks = load_task()
-    tags = []
+def get_task_dues():
+    dues = total_due_counts()
 
-    for t in tasks:
-        if 'tag' in t and t['tag']:
-            tags.append(t['tag'])
+    print(f'Due Today:      {dues["today"]}')
+    print(f'Due This Week:  {dues["week"]}')
+    print(f'Due This Month: {dues["month"]}')
+    print(f'OverDue:        {dues["overdue"]}')
 
-    counts = Counter(tags)
+def count_tags():
+    counts = total_tag_counts()
 
-    for key, value in counts.items():
+    for key, value in counts.most_common():
         print(f'{value} - {key}')
 
 def statistics_screen():
-    tasks = load_task()
+    stats = total_stats()
 
-    total_tasks = [t for t in tasks]
-    completed_tasks = [t for t in tasks if t['done']]
-    pending_tasks = [t for t in tasks if not t['done']]
+    completion_rate = stats.rate(stats.done)
+    remaining_rate = (100 - completion_rate) if stats.total else 0
 
-    completion_rate = (len(pending_tasks) * 100) / len(total_tasks)
-    remaining_rate = (100 - completion_rate)
-
-    high_pri_tasks = [t for t in tasks if t['priority'] == 'high']
-    med_pri_tasks = [t for t in tasks if t['priority'] == 'medium']
-    low_pri_tasks = [t for t in tasks if t['priority'] == 'low']
-    
-    high_pri_rate = (len(high_pri_tasks) * 100) / len(total_tasks)
-    med_pri_rate = (len(med_pri_tasks) * 100) / len(total_tasks)
-    low_pri_rate = (len(low_pri_tasks) * 100) / len(total_tasks)
+    high_pri_rate = stats.rate(stats.priorities['high'])
+    med_pri_rate = stats.rate(stats.priorities['medium'])
+    low_pri_rate = stats.rate(stats.priorities['low'])
 
     print('''
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 |         STATISTICS          |
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 ''')
-    print(f'Total Tasks:       {len(total_tasks)}')
-    print(f'Task Completed:    {len(completed_tasks)}')
-    print(f'Task Pending:      {len(pending_tasks)}')
+    print(f'Total Tasks:       {stats.total}')
+    print(f'Task Completed:    {stats.done}')
+    print(f'Task Pending:      {stats.pending}')
     print(f'\nCompletion Rate:   {completion_rate:.2f}%')
     print(f'Remaining Rate:    {remaining_rate:.2f}%')
 
     print('\n||━━━━━ PRIORITY_WISE ━━━━━||\n')
-    print(f'High Priority:   {len(high_pri_tasks)} | {high_pri_rate:.2f}%')
-    print(f'Medium Priority: {len(med_pri_tasks)} | {med_pri_rate:.2f}%')
-    print(f'Low Priority:    {len(low_pri_tasks)} | {low_pri_rate:.2f}%')
+    print(f"High Priority:   {stats.priorities['high']} | {high_pri_rate:.2f}%")
+    print(f"Medium Priority: {stats.priorities['medium']} | {med_pri_rate:.2f}%")
+    print(f"Low Priority:    {stats.priorities['low']} | {low_pri_rate:.2f}%")
 
     print('\n||━━━━━ TASKS_DUES ━━━━━||\n')
     get_task_dues()
 
     print('\n||━━━━━ TASKS_BY_TAGS ━━━━━||\n')
     count_tags()
-    time.sleep(1)
+    pause()
+
+# Helper for export_tasks(): write_export
+EXPORT_CHUNK = 10000
+EXPORT_FORMATS = {'1': 'txt', '2': 'csv', '3': 'jsonl'}
+CSV_FIELDS = ['id', 'title', 'priority', 'due date', 'done', 'tag', 'description']
+
+# The export file as pieces of text, the header and then one piece per chunk
+# of tasks, each with the number of tasks in it. Used by write_export() and
+# the /export endpoint of the serve command.
+def export_text(fmt, chunks):
+    out = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, fieldnames=CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+    elif fmt == 'txt':
+        out.write(TASK_HEADERS + '\n')
+        out.write('-'*95 + '\n')
+    yield out.getvalue(), 0
+
+    for chunk in chunks:
+        out.seek(0)
+        out.truncate()
+        if fmt == 'csv':
+            writer.writerows(chunk)
+        elif fmt == 'txt':
+            out.writelines(format_task(t) + '\n' for t in chunk)
+        else:
+            out.writelines(json_dumps(t) + '\n' for t in chunk)
+        yield out.getvalue(), len(chunk)
+
+# Streams the store to path chunk by chunk, so memory stays the size of one
+# chunk however many tasks there are. A path ending in .gz is gzip compressed.
+# expression is a query (see parse_query) the tasks have to match.
+# Returns the number of tasks written.
+def write_export(path, fmt, expression=''):
+    if expression:
+        tasks = store.scan(parse_query(expression))
+        chunks = iter(lambda: list(islice(tasks, EXPORT_CHUNK)), [])
+    elif store.loaded:
+        chunks = store.chunks(EXPORT_CHUNK)
+    else:
+        tasks = store.scan([])
+        chunks = iter(lambda: list(islice(tasks, EXPORT_CHUNK)), [])
+    opener = gzip.open if path.endswith('.gz') else open
+    count = 0
+    with opener(path, 'wt', encoding='utf-8', newline='') as f:
+        for text, size in export_text(fmt, chunks):
+            f.write(text)
+            count += size
+    if metrics:
+        metrics.count('export bytes written', os.path.getsize(path))
+        metrics.count('export records written', count)
+    return count
 
 def export_tasks():
     print('''
@@ -508,57 +3403,138 @@ def export_tasks():
 |        EXPORT TASKS         |
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 ''')
-    tasks = load_task()
     print('\nYou can import you date as following:')
     print('1. .txt file')
     print('2. .csv file')
-    path = os.getcwd()
+    print('3. .jsonl file (one task per line)')
     while True:
-        format = input('\nEnter (1 / 2): ')
-
-        if format == '1':
-            headers = f'{'ID':<10} {'Title':<15} {'Priority':<10} {'Due Date':<15} {'Done':<5} {'Tags':<15} {'Description'}'
-            with open('tasks.txt', 'w', encoding='utf-8') as f:
-                f.write(headers + '\n')
-                f.write('-'*95 + '\n')
-                for t in tasks:
-                    done = '✅' if t['done'] else '❌'
-                    priority = '🔴' if t['priority'] == 'high' else '🟡' if t['priority'] == 'medium' else '🟢'
-                    f.write(f"{t['id']:<10} {t['title']:<15} {priority:<10} {t['due date']:<15} {done:<5} {t['tag']:<15} {t['description']}\n")
-            print(f'\n✅ All the data imported at path: {os.path.join(path, 'tasks.txt')}.')
-            break
-
-        elif format == '2':
-            with open('tasks.csv', 'w') as csvfile:
-                fieldnames = ['id', 'title', 'priority', 'due date', 'done', 'tag', 'description']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        format = input('\nEnter (1 / 2 / 3): ')
 
-                writer.writeheader()
-                for t in tasks:
-                    writer.writerow(t)
-            print(f'\n✅ All the data imported at path: {os.path.join(path, 'tasks.csv')}.') 
+        if format in EXPORT_FORMATS:
+            fmt = EXPORT_FORMATS[format]
+            path = input(f'\nEnter file name (Enter for tasks.{fmt}): ').strip() or f'tasks.{fmt}'
+            if input('\nCompress with gzip (y/n): ').strip().lower() == 'y' and not path.endswith('.gz'):
+                path += '.gz'
+            expression = input('\nOnly export tasks matching i.e, priority=high tag=study due<2025/01/01 (Enter for all): ').strip()
+            try:
+                count = write_export(path, fmt, expression)
+            except ValueError as e:
+                print(f'\n❌ Error: {e}')
+                continue
+            print(f'\n✅ {count} tasks exported at path: {os.path.abspath(path)}.')
             break
 
         elif format == '0':
             print('\n🛑 - Exporting stopped!')
             break
         else:
-            print('\n❌ Error: Enter (1 / 2) or 0 to stop!')
-    time.sleep(1)
+            print('\n❌ Error: Enter (1 / 2 / 3) or 0 to stop!')
+    pause()
+
+# Helpers for import_tasks(): 1 - read_import 2 - clean_import_row 3 - load_import
+# Rows from a .csv (same columns export_tasks writes) or .jsonl file, .gz works too
+def read_import(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        if path.removesuffix('.gz').endswith('.csv'):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json_loads(line)
+
+# Checks one imported row with the same rules as add_task(). Returns the task
+# (id may be None) or raises ValueError saying what is wrong.
+def clean_import_row(row):
+    for key in ['title', 'priority', 'due date']:
+        if not str(row.get(key) or '').strip():
+            raise ValueError(f'{key} is missing')
+    priority = valid_priority(row['priority'])
+    if not priority:
+        raise ValueError(f"invalid priority [{row['priority']}], choose high/medium/low")
+    due_date = valid_date(row['due date'].strip())
+    if not due_date:
+        raise ValueError(f"invalid date [{row['due date']}], use YYYY/MM/DD")
+    done = row.get('done', False)
+    if not isinstance(done, bool):
+        done = str(done).strip().lower() in ['true', '1', 'yes', 'y']
+    task_id = str(row.get('id') or '').strip() or None
+    return {
+        'id': task_id,
+        'title': row['title'].strip(),
+        'priority': priority,
+        'due date': due_date,
+        'done': done,
+        'description': str(row.get('description') or '').strip(),
+        'tag': str(row.get('tag') or '').strip()
+            }
+
+# Validates every row, gives new IDs (in one batch) to rows without one or with
+# an ID that is already taken, then adds them all in one write / transaction.
+# Returns (number imported, list of 'line: error' for rows that were skipped).
+def load_import(path):
+    tasks = []
+    errors = []
+    seen = set()
+    for line_no, row in enumerate(read_import(path), start=1):
+        try:
+            task = clean_import_row(row)
+        except (ValueError, AttributeError) as e:
+            errors.append(f'{line_no}: {e}')
+            continue
+        if task['id'] in seen or (task['id'] and task['id'] in store):
+            task['id'] = None
+        seen.add(task['id'])
+        tasks.append(task)
+
+    missing = [t for t in tasks if t['id'] is None]
+    for task, task_id in zip(missing, store.new_ids(len(missing))):
+        task['id'] = task_id
+    store.add_many(tasks)
+    store.save()
+    return len(tasks), errors
+
+def import_tasks():
+    print('''
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+|        IMPORT TASKS         |
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+''')
+    print('\nImport a .csv (same columns as the export) or .jsonl file, .gz files work too.')
+    while True:
+        path = input('\nEnter file path: ').strip()
+        if path == '0':
+            print('\n🛑 - Importing stopped!')
+            break
+        if not os.path.exists(path):
+            print('\n❌ Error: File does not exist!')
+            continue
+        try:
+            count, errors = load_import(path)
+        except (ValueError, csv.Error, OSError) as e:
+            print(f'\n❌ Error: Could not read file: {e}')
+            break
+        print(f'\n✅ {count} tasks imported!')
+        if errors:
+            print(f'\n🛑 - {len(errors)} rows skipped:')
+            for error in errors[:10]:
+                print(f'   line {error}')
+        break
+    pause()
 
 def intro():
     text = '\n ||  **  WELCOME TO TASK MASTER ** ||\n\nYour ultimate task managment  assistant'
     for i in text:
         print(i, end='', flush=True)
         time.sleep(0.04)
-    time.sleep(1)
+    pause()
 
 def ending():
     text = '\n|| ** THANKS FOR USING THIS TASK MANAGER ** ||'
     for i in text:
         print(i, end='', flush=True)
         time.sleep(0.04)
-    time.sleep(1)
+    pause()
 
 def guide():
     print('''
@@ -583,6 +3559,9 @@ def guide():
 
 5. Filter / Sort
    - Filter by priority or status
+   - Search takes words and/or filters, i.e,
+     priority=high done=false tag=study due<2025/01/01 "some words"
+   - Archived tasks (python manager.py archive) can be searched too
    - Sort by title, priority, due date, or status
 
 6. Complete Task
@@ -594,14 +3573,17 @@ def guide():
    - Due today / week / overdue
 
 8. Export
-   - Export tasks to .txt, .csv, or .json
+   - Export tasks to .txt, .csv, or .jsonl
+
+9. Import
+   - Load many tasks at once from a .csv or .jsonl file
 
 Tip:
 - Enter 0 anytime to cancel an action
 
 ============================================
 ''')
-    time.sleep(1)
+    pause()
 
 def show_all():
     print('\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n')
@@ -619,29 +3601,847 @@ def show_all():
     print('11. Filter by Tag')
     print('12. Filter by Status')
     print('13. Access Guide')
+    print('14. Import data')
+
+# Command mode: python manager.py add|mark|delete|update|list|search|stats|export|import|batch ...
+# Runs one action without the menu, animations or pauses, for scripts and cron jobs.
+# Writes EXPORT_CHUNK rows per write, skipping offset tasks and stopping after limit
+def print_tasks(tasks, as_json=False, offset=0, limit=None):
+    tasks = islice(tasks, offset, None if limit is None else offset + limit)
+    if as_json:
+        row = json_dumps
+    else:
+        row = format_task
+        sys.stdout.write(TASK_HEADERS + '\n' + '-'*95 + '\n')
+    while True:
+        chunk = list(islice(tasks, EXPORT_CHUNK))
+        if not chunk:
+            break
+        sys.stdout.write(''.join(row(t) + '\n' for t in chunk))
+
+# Blank text is refused like get_input() does in the menu
+def checked_text(value, name):
+    if not value.strip():
+        raise ValueError(f'{name} cannot be empty!')
+    return value.strip()
+
+def checked_fields(args):
+    fields = {}
+    if args.title is not None:
+        fields['title'] = checked_text(args.title, 'Title')
+    if args.description is not None:
+        fields['description'] = checked_text(args.description, 'Description')
+    if args.priority is not None:
+        fields['priority'] = valid_priority(args.priority)
+        if not fields['priority']:
+            raise ValueError('Invalid priority! Choose high/medium/low.')
+    if args.due is not None:
+        fields['due date'] = valid_date(args.due)
+        if not fields['due date']:
+            raise ValueError('Invalid date! Use format YYYY/MM/DD. Example: 2008/08/13.')
+    if args.tag is not None:
+        fields['tag'] = checked_text(args.tag, 'Tags')
+    return fields
+
+def existing_task(task_id):
+    task = store.get(task_id)
+    if task is None:
+        raise ValueError(f'Id does not match: {task_id}')
+    return task
+
+def cmd_add(args):
+    fields = checked_fields(args)
+    task = store.add(new_task(fields['title'], fields['description'], fields['priority'], fields['due date'], fields['tag']))
+    print(task['id'])
+
+def cmd_mark(args):
+    for task_id in args.ids:
+        if not existing_task(task_id)['done']:
+            store.mark_done(task_id)
+
+def cmd_delete(args):
+    for task_id in args.ids:
+        existing_task(task_id)
+        store.delete(task_id)
+
+def cmd_update(args):
+    existing_task(args.id)
+    fields = checked_fields(args)
+    if not fields:
+        raise ValueError('Nothing to update, use --title, --description, --priority, --due or --tag')
+    store.update(args.id, fields, args.if_version)
+
+# Watch mode (stats --watch, list --watch): the screen is drawn again each
+# time another session or script changes the tasks. Looking for changes only
+# looks at the files (see state()), and catching up only reads what was
+# written since (see refresh()), which also brings the counts and indexes the
+# screens are drawn from up to date, so nothing is counted again from scratch.
+WATCH_EVERY = 1
+CLEAR_SCREEN = '\033[H\033[2J'
+
+# Calls draw(changed) with the ids refresh() says changed (None the first
+# time and when it can't tell) until Ctrl+C
+def watch(draw, interval=WATCH_EVERY):
+    seen = None
+    try:
+        while True:
+            now = store.state(), file_state(store.archive.summary_path)
+            if now != seen:
+                changed = store.refresh() if seen is not None else None
+                seen = now
+                sys.stdout.write(CLEAR_SCREEN)
+                draw(changed)
+                print(f'\n👀 Watching for changes, updated {datetime.now():%H:%M:%S}. Ctrl+C to stop.')
+                sys.stdout.flush()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print()
+
+# The tasks matching a query, kept up to date by checking only the tasks
+# that changed instead of running the query again. Tasks that start matching
+# are added at the end.
+class LiveQuery:
+    def __init__(self, conditions):
+        self.conditions = conditions
+        self.ids = {}
+
+    def update(self, changed=None):
+        if changed is None:
+            self.ids = dict.fromkeys(task['id'] for task in store.find(self.conditions))
+        else:
+            for task_id in changed:
+                task = store.get(task_id)
+                if task is not None and any(True for _ in scan_tasks([task], self.conditions)):
+                    self.ids.setdefault(task_id)
+                else:
+                    self.ids.pop(task_id, None)
+        return (store.get(task_id) for task_id in self.ids)
+
+# The query list's filter options stand for, None without one
+def list_conditions(args):
+    if args.priority:
+        return [('priority', '=', PRIORITIES.index(args.priority))]
+    if args.done:
+        return [('done', '=', args.done == 'true')]
+    if args.tag:
+        return [('tag', '=', split_tags(args.tag))]
+    if args.query:
+        return parse_query(args.query)
+    return None
+
+def listed_tasks(args, conditions):
+    if conditions is not None:
+        return store.scan(conditions)
+    if args.sort:
+        return store.sorted_tasks(args.sort, args.reverse)
+    return store.view_tasks()
+
+def cmd_list(args):
+    conditions = list_conditions(args)
+    if args.archived:
+        if args.watch:
+            raise ValueError('Archived tasks never change, there is nothing to watch')
+        if conditions is None and args.sort:
+            raise ValueError('Archived tasks can only be listed in the order they were archived')
+        tasks = store.archive.scan(conditions or [])
+    elif args.watch:
+        if conditions is None:
+            # The whole list comes from indexes that are already kept up to date
+            draw = lambda changed: listed_tasks(args, None)
+        else:
+            draw = LiveQuery(conditions).update
+        watch(lambda changed: print_tasks(draw(changed), args.json, args.offset, args.limit), args.interval)
+        return
+    else:
+        tasks = listed_tasks(args, conditions)
+    print_tasks(tasks, args.json, args.offset, args.limit)
+
+def cmd_search(args):
+    source = store.archive if args.archived else store
+    print_tasks(source.scan([('text', ':', args.text)], args.limit), args.json)
+
+def cmd_stats(args):
+    if args.internal:
+        internal_stats_screen(METRICS_FILE or 'tasks.metrics.jsonl')
+    elif args.watch:
+        watch(lambda changed: statistics_screen(), args.interval)
+    else:
+        statistics_screen()
+
+def cmd_archive(args):
+    if args.days < 0:
+        raise ValueError('--days can not be negative')
+    # Going back further than year 1 doesn't fit in a date
+    most = (date.today() - date.min).days
+    if args.days > most:
+        raise ValueError(f'--days can be at most {most}')
+    count = store.archive.move(store, args.days)
+    print(f'{count} tasks archived to {store.archive.path}')
+
+def cmd_export(args):
+    count = write_export(args.path, args.format, args.filter)
+    print(f'{count} tasks exported to {os.path.abspath(args.path)}')
+
+def cmd_import(args):
+    count, errors = load_import(args.path)
+    for error in errors:
+        print(f'line {error}', file=sys.stderr)
+    print(f'{count} tasks imported')
+
+# One command per line, same syntax as on the command line (without
+# "manager.py"). Empty lines and lines starting with # are skipped.
+# Everything is saved once at the end instead of after every command.
+def cmd_batch(args):
+    parser = build_parser()
+    # Loaded once, so the commands use the indexes instead of each reading the files (see scan())
+    store.ensure_loaded()
+    f = sys.stdin if args.file == '-' else open(args.file, encoding='utf-8')
+    failed = 0
+    with f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                batch_args = parser.parse_args(shlex.split(line))
+            except SystemExit:
+                # argparse already printed what is wrong with the line
+                failed += 1
+                print(f'line {line_no}: invalid command', file=sys.stderr)
+                continue
+            try:
+                if batch_args.command in [None, 'batch']:
+                    raise ValueError('Expected a command')
+                if metrics:
+                    measured('command ' + batch_args.command, batch_args.handler)(batch_args)
+                else:
+                    batch_args.handler(batch_args)
+            except ValueError as e:
+                failed += 1
+                print(f'line {line_no}: {e}', file=sys.stderr)
+    if failed:
+        raise ValueError(f'{failed} commands failed')
+
+# Synthetic tasks for trying things out at size (generate command) and for
+# the benchmarks. The mix is made up but roughly what real lists look like:
+# mostly medium priority, due dates bunched around the coming weeks with a
+# tail of overdue ones, a few tags that are used a lot and many that aren't,
+# and descriptions from empty to a few paragraphs. The same seed always gives
+# the same tasks.
+SAMPLE_WORDS = ('report', 'meeting', 'email', 'call', 'review', 'plan', 'buy', 'fix', 'write',
+                'read', 'book', 'pay', 'clean', 'send', 'update', 'check', 'prepare', 'exam',
+                'chapter', 'invoice', 'doctor', 'groceries', 'project', 'slides', 'notes',
+                'budget', 'draft', 'bug', 'release', 'garden', 'car', 'rent', 'gift', 'trip',
+                'python', 'homework', 'lecture', 'gym', 'dentist', 'milk')
+SAMPLE_TAGS = ('work', 'home', 'study', 'shop', 'health', 'finance', 'family', 'exam', 'project',
+               'urgent', 'travel', 'music', 'reading', 'car', 'garden', 'friends', 'sport',
+               'python', 'bills', 'kids', 'cooking', 'house', 'office', 'learning', 'hobby',
+               'someday', 'waiting', 'errands', 'pets', 'admin')
+
+def generate_tasks(count, seed=0, today=None):
+    rng = random.Random(seed)
+    today = (today or date.today()).toordinal()
+    dates = {}
+    # Descriptions are slices of one long text, which is much faster than
+    # picking every word
+    text = ' '.join(rng.choices(SAMPLE_WORDS, k=2000))
+    tag_weights = [1 / (i + 1) for i in range(len(SAMPLE_TAGS))]
+    for _ in range(count):
+        offset = int(rng.triangular(-90, 365, 7))
+        if offset not in dates:
+            day = date.fromordinal(today + offset)
+            dates[offset] = f'{day.year:04d}/{day.month:02d}/{day.day:02d}'
+        length = min(int(rng.lognormvariate(3.5, 1)), 1000)
+        start = text.find(' ', rng.randrange(len(text) - length)) + 1
+        yield {
+            'title': ' '.join(rng.choices(SAMPLE_WORDS, k=rng.randint(2, 6))).title(),
+            'priority': rng.choices(PRIORITIES, weights=(2, 5, 3))[0],
+            'due date': dates[offset],
+            'done': rng.random() < (0.7 if offset < 0 else 0.2),
+            'description': text[start:start + length].strip(),
+            'tag': join_tags(set(rng.choices(SAMPLE_TAGS, tag_weights, k=rng.choices((0, 1, 2, 3), (1, 5, 3, 1))[0]))),
+        }
+
+# Adds them EXPORT_CHUNK at a time, with IDs from the store
+def add_generated(store, count, seed=0):
+    tasks = generate_tasks(count, seed)
+    while chunk := list(islice(tasks, EXPORT_CHUNK)):
+        for task, task_id in zip(chunk, store.new_ids(len(chunk))):
+            task['id'] = task_id
+        store.add_many(chunk)
+    store.save()
+
+def cmd_generate(args):
+    add_generated(store, args.count, args.seed)
+    print(f'{args.count} tasks generated')
+
+# bench command: times the main operations on generated data for every size
+# and backend, each in a new folder. Every operation runs once on a freshly
+# loaded store (cold, this is where indexes get built) and then `repeat`
+# more times (warm, the best is kept). A second pass under tracemalloc on a
+# fresh store gives each operation's peak memory. tracemalloc only sees
+# Python's own allocations, not SQLite's.
+BENCH_QUERY = 'priority=high done=false tag=work'
+
+def bench_operations(store, folder):
+    some_id = next(store.iter_tasks())['id']
+
+    def update():
+        store.update(some_id, {'title': 'Benchmark'})
+        store.save()
+
+    ops = {
+        'search': lambda: store.search('invoice'),
+        'search_rare': lambda: store.search('dentist milk garden'),
+        'query': lambda: list(store.find(parse_query(BENCH_QUERY))),
+        'stats': lambda: (store.stats(), store.due_counts(), store.tag_counts()),
+        'export_csv': lambda: write_export(os.path.join(folder, 'export.csv'), 'csv'),
+        'update': update,
+    }
+    for order in SORT_ORDERS:
+        ops['sort_' + order] = lambda order=order: sum(1 for _ in store.sorted_tasks(order))
+    # Rewriting tasks.json whole, what save_task() costs
+    if isinstance(store, TaskStore):
+        def compact():
+            with store.lock:
+                store.compact()
+        ops['compact'] = compact
+    return ops
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def run_bench(backend, size, repeat, seed, folder):
+    global store
+    paths = {'json': {'path': os.path.join(folder, TASKS_FILE)},
+             'sqlite': {'path': os.path.join(folder, SQLITE_FILE), 'json_path': os.path.join(folder, TASKS_FILE)},
+             'shards': {'folder': os.path.join(folder, SHARDS_DIR), 'json_path': os.path.join(folder, TASKS_FILE)}}
+    results = []
+
+    def result(op, cold, warm=None, peak=None):
+        results.append({'backend': backend, 'size': size, 'op': op, 'cold_s': round(cold, 6),
+                        'warm_s': None if warm is None else round(warm, 6), 'peak_mb': peak})
+
+    new_store = lambda: BACKENDS[backend](**paths[backend])
+    setup = new_store()
+    result('add', timed(lambda: add_generated(setup, size, seed)))
+    setup.close()
+
+    old_store = store
+    try:
+        store = new_store()
+        result('load', timed(store.ensure_loaded))
+        for name, func in bench_operations(store, folder).items():
+            cold = timed(func)
+            warm = min([timed(func) for _ in range(repeat)], default=None)
+            result(name, cold, warm)
+        store.close()
+
+        # Memory, on another fresh store so the indexes are built again
+        tracemalloc.start()
+        try:
+            store = new_store()
+            store.ensure_loaded()
+            peaks = {'load': tracemalloc.get_traced_memory()[1]}
+            for name, func in bench_operations(store, folder).items():
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                func()
+                peaks[name] = tracemalloc.get_traced_memory()[1] - before
+            store.close()
+        finally:
+            tracemalloc.stop()
+    finally:
+        store = old_store
+    for r in results:
+        if r['op'] in peaks:
+            r['peak_mb'] = round(peaks[r['op']] / 2 ** 20, 2)
+    return results
+
+def cmd_bench(args):
+    try:
+        sizes = [int(size) for size in args.sizes.split(',')]
+    except ValueError:
+        raise ValueError(f'--sizes must be numbers separated by commas: {args.sizes}')
+    backends = args.backends.split(',')
+    for backend in backends:
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown backend: {backend}. Choose from {", ".join(BACKENDS)}')
+    results = []
+    for size in sizes:
+        for backend in backends:
+            folder = tempfile.mkdtemp(prefix='tasks-bench-')
+            try:
+                rows = run_bench(backend, size, args.repeat, args.seed, folder)
+            finally:
+                shutil.rmtree(folder, ignore_errors=True)
+            for r in rows:
+                warm = '-' if r['warm_s'] is None else f"{r['warm_s'] * 1000:.2f}"
+                peak = '-' if r['peak_mb'] is None else f"{r['peak_mb']:.2f}"
+                print(f"{backend:7} {size:>9} {r['op']:14} cold {r['cold_s'] * 1000:10.2f} ms   warm {warm:>10} ms   peak {peak:>8} MB")
+            results += rows
+    with open(args.out, 'w') as f:
+        json.dump({
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'results': results,
+        }, f, indent=3)
+    print(f'Results written to {os.path.abspath(args.out)}')
+
+# serve command: a small HTTP/1.1 JSON API on asyncio, standard library only.
+#   GET    /tasks?query=...&sort=...&reverse=true&offset=0&limit=100
+#   POST   /tasks                {"title", "description", "priority", "due", "tag"}
+#   GET    /tasks/<id>
+#   PATCH  /tasks/<id>           any of the fields above, "version" to detect conflicts
+#   POST   /tasks/<id>/done
+#   DELETE /tasks/<id>?version=3
+#   GET    /search?q=words&offset=0&limit=100
+#   GET    /stats
+#   GET    /export?format=jsonl|csv|txt&filter=...
+# One store is shared by every request. Each request is handled in one go on
+# the event loop, so the store needs no locking of its own, and only sending
+# the response waits on the client. Lists come in pages and every response
+# is sent in chunks as it is written.
+# Requests that change something must be sent as application/json, which a web
+# page from another site can't do without asking first (and we never answer).
+API_PAGE_SIZE = 100
+API_MAX_PAGE = 1000
+API_MAX_BODY = 1 << 20
+API_FIELDS = ('title', 'description', 'priority', 'due', 'tag')
+HTTP_STATUS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large',
+               415: 'Unsupported Media Type', 500: 'Internal Server Error'}
+EXPORT_TYPES = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv', 'txt': 'text/plain'}
+
+class ApiError(ValueError):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# Responses are (status, content type, pieces of the body)
+def json_response(status, data):
+    return status, 'application/json', [json_dumps(data)]
+
+def page_params(params):
+    try:
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', API_PAGE_SIZE))
+    except ValueError:
+        raise ApiError(400, 'offset and limit must be numbers')
+    if offset < 0 or not 0 < limit <= API_MAX_PAGE:
+        raise ApiError(400, f'offset must be 0 or more and limit 1 - {API_MAX_PAGE}')
+    return offset, limit
+
+# The page is taken from the store right away, only turning it into JSON is
+# spread over the chunks
+def page_response(tasks, params):
+    offset, limit = page_params(params)
+    page = list(islice(tasks, offset, offset + limit + 1))
+    more = len(page) > limit
+    del page[limit:]
+    head = json.dumps({'offset': offset, 'limit': limit, 'next': offset + limit if more else None})
+
+    def body():
+        yield head[:-1] + ', "tasks": ['
+        for start in range(0, len(page), API_PAGE_SIZE):
+            rows = ', '.join(json_dumps(t) for t in page[start:start + API_PAGE_SIZE])
+            yield (', ' if start else '') + rows
+        yield ']}'
+    return 200, 'application/json', body()
+
+def api_task(task_id):
+    task = store.get(task_id)
+    if task is None:
+        raise ApiError(404, f'Id does not match: {task_id}')
+    return task
+
+# Same checks as the add and update commands
+def api_fields(body):
+    if not isinstance(body, dict):
+        raise ApiError(400, 'Expected a JSON object')
+    values = {name: None if body.get(name) is None else str(body[name]) for name in API_FIELDS}
+    return checked_fields(argparse.Namespace(**values))
+
+def api_version(value):
+    try:
+        return None if value is None else int(value)
+    except ValueError:
+        raise ApiError(400, 'version must be a number')
+
+def api_list(params):
+    sort = params.get('sort')
+    if sort and sort not in SORT_ORDERS:
+        raise ApiError(400, f'sort must be one of {", ".join(SORT_ORDERS)}')
+    if params.get('query'):
+        tasks = store.find(parse_query(params['query']))
+    elif sort:
+        tasks = store.sorted_tasks(sort, params.get('reverse') == 'true')
+    else:
+        tasks = store.view_tasks()
+    return page_response(tasks, params)
+
+def api_add(body):
+    fields = api_fields(body)
+    missing = [name for name in API_FIELDS if body.get(name) is None]
+    if missing:
+        raise ApiError(400, f'Missing {", ".join(missing)}')
+    task = store.add(new_task(fields['title'], fields['description'], fields['priority'], fields['due date'], fields['tag']))
+    store.save()
+    return json_response(201, task)
+
+def api_update(task_id, body):
+    api_task(task_id)
+    fields = api_fields(body)
+    if not fields:
+        raise ApiError(400, f'Nothing to update, use {", ".join(API_FIELDS)}')
+    task = store.update(task_id, fields, api_version(body.get('version')))
+    store.save()
+    return json_response(200, task)
+
+def api_mark(task_id):
+    api_task(task_id)
+    task = store.mark_done(task_id)
+    store.save()
+    return json_response(200, task)
+
+def api_delete(task_id, params):
+    api_task(task_id)
+    task = store.delete(task_id, api_version(params.get('version')))
+    store.save()
+    return json_response(200, task)
+
+def api_search(params):
+    if not params.get('q'):
+        raise ApiError(400, 'Use /search?q=words')
+    source = store.archive if params.get('archived') == 'true' else store
+    return page_response(source.scan([('text', ':', params['q'])]), params)
+
+def api_stats():
+    stats = total_stats()
+    return json_response(200, {
+        'total': stats.total,
+        'done': stats.done,
+        'pending': stats.pending,
+        'completion_rate': round(stats.rate(stats.done), 2),
+        'priorities': {p: stats.priorities[p] for p in PRIORITIES},
+        'due': total_due_counts(),
+        'tags': dict(total_tag_counts().most_common()),
+    })
+
+def api_export(params):
+    fmt = params.get('format', 'jsonl')
+    if fmt not in EXPORT_TYPES:
+        raise ApiError(400, f'format must be one of {", ".join(EXPORT_TYPES)}')
+    tasks = store.find(parse_query(params['filter'])) if params.get('filter') else store.iter_tasks()
+    if isinstance(store, (TaskStore, ShardedStore)):
+        # Their generators walk live dicts, which requests handled between two
+        # chunks may change. A list of the task objects is cheap.
+        tasks = list(tasks)
+    tasks = iter(tasks)
+    chunks = iter(lambda: list(islice(tasks, EXPORT_CHUNK)), [])
+    return 200, EXPORT_TYPES[fmt], (text for text, size in export_text(fmt, chunks))
+
+def route(method, path, params, body):
+    parts = [urllib.parse.unquote(part) for part in path.split('/') if part]
+    routes = {}
+    if parts == ['tasks']:
+        routes = {'GET': lambda: api_list(params), 'POST': lambda: api_add(body)}
+    elif len(parts) == 2 and parts[0] == 'tasks':
+        routes = {'GET': lambda: json_response(200, api_task(parts[1])),
+                  'PATCH': lambda: api_update(parts[1], body),
+                  'DELETE': lambda: api_delete(parts[1], params)}
+    elif len(parts) == 3 and parts[0] == 'tasks' and parts[2] == 'done':
+        routes = {'POST': lambda: api_mark(parts[1])}
+    elif parts == ['search']:
+        routes = {'GET': lambda: api_search(params)}
+    elif parts == ['stats']:
+        routes = {'GET': api_stats}
+    elif parts == ['export']:
+        routes = {'GET': lambda: api_export(params)}
+    else:
+        raise ApiError(404, f'No such endpoint: {path}')
+    if method not in routes:
+        raise ApiError(405, f'{method} is not allowed on {path}, use {", ".join(routes)}')
+    return routes[method]()
+
+def handle_request(method, target, headers, body):
+    url = urllib.parse.urlsplit(target)
+    params = dict(urllib.parse.parse_qsl(url.query))
+    try:
+        if method != 'GET' and headers.get('content-type', '').split(';')[0].strip() != 'application/json':
+            raise ApiError(415, 'Send requests that change tasks as application/json')
+        body = json.loads(body) if body.strip() else {}
+        # Show what other sessions changed since the last request
+        store.refresh()
+        return route(method, url.path, params, body)
+    except ApiError as e:
+        return json_response(e.status, {'error': str(e)})
+    except ConflictError as e:
+        return json_response(409, {'error': str(e)})
+    except ValueError as e:
+        return json_response(400, {'error': str(e)})
+    except Exception as e:
+        print(f'{method} {target}: {e!r}', file=sys.stderr)
+        return json_response(500, {'error': 'Internal error'})
+
+# (method, target, headers, body), or None when the client closed the connection
+async def read_request(reader):
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise ApiError(400, 'Bad request line')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise ApiError(400, 'Bad Content-Length')
+    if length > API_MAX_BODY:
+        raise ApiError(413, f'Body is over {API_MAX_BODY} bytes')
+    body = await reader.readexactly(length) if length > 0 else b''
+    return method.upper(), target, headers, body
+
+# A body given as a list is sent with its length, anything else chunk by chunk
+async def send_response(writer, response, keep_alive):
+    status, content_type, body = response
+    head = [f'HTTP/1.1 {status} {HTTP_STATUS[status]}',
+            f'Content-Type: {content_type}; charset=utf-8',
+            'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+    if isinstance(body, list):
+        data = ''.join(body).encode()
+        writer.write(('\r\n'.join(head + [f'Content-Length: {len(data)}']) + '\r\n\r\n').encode() + data)
+    else:
+        writer.write(('\r\n'.join(head + ['Transfer-Encoding: chunked']) + '\r\n\r\n').encode())
+        for text in body:
+            data = text.encode()
+            if data:
+                writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+                await writer.drain()
+        writer.write(b'0\r\n\r\n')
+    await writer.drain()
+
+async def serve_client(reader, writer):
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except ApiError as e:
+                await send_response(writer, json_response(e.status, {'error': str(e)}), False)
+                break
+            if request is None:
+                break
+            method, target, headers, body = request
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            await send_response(writer, handle_request(method, target, headers, body), keep_alive)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(host, port):
+    server = await asyncio.start_server(serve_client, host, port, backlog=1024)
+    print(f'Serving tasks on http://{host}:{port} (Ctrl+C to stop)', flush=True)
+    async with server:
+        await server.serve_forever()
+
+def cmd_serve(args):
+    store.ensure_loaded()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='manager.py', description='CLI Task Manager. Run without a command for the menu.')
+    parser.add_argument('--backend', choices=list(BACKENDS), help='storage to use (default: TASKS_BACKEND or json)')
+    parser.add_argument('--profile', choices=['cpu', 'memory'], help='profile the command, report goes to stderr')
+    parser.add_argument('--profile-out', metavar='FILE', help='also save the cProfile data (for --profile cpu)')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+
+    def task_options(command, required):
+        command.add_argument('--title', required=required)
+        command.add_argument('--description', required=required)
+        command.add_argument('--priority', required=required, help='high / medium / low')
+        command.add_argument('--due', required=required, help='YYYY/MM/DD')
+        command.add_argument('--tag', required=required)
+
+    def watch_options(command):
+        command.add_argument('--watch', action='store_true', help='draw again whenever the tasks change, Ctrl+C to stop')
+        command.add_argument('--interval', type=float, default=WATCH_EVERY, help='seconds between looks for changes')
+
+    add = commands.add_parser('add', help='add a task and print its ID')
+    task_options(add, True)
+    add.set_defaults(handler=cmd_add)
+
+    mark = commands.add_parser('mark', help='mark tasks as done')
+    mark.add_argument('ids', nargs='+')
+    mark.set_defaults(handler=cmd_mark)
+
+    delete = commands.add_parser('delete', help='delete tasks')
+    delete.add_argument('ids', nargs='+')
+    delete.set_defaults(handler=cmd_delete)
+
+    update = commands.add_parser('update', help='change fields of a task')
+    update.add_argument('id')
+    task_options(update, False)
+    update.add_argument('--if-version', type=int, help='fail if the task was changed since this version')
+    update.set_defaults(handler=cmd_update)
+
+    list_ = commands.add_parser('list', help='show tasks, optionally filtered')
+    filters = list_.add_mutually_exclusive_group()
+    filters.add_argument('--priority', choices=VALID_PRIORITIES)
+    filters.add_argument('--done', choices=['true', 'false'])
+    filters.add_argument('--tag', help='a,b for tasks with any of them')
+    filters.add_argument('--query', help='i.e, "priority=high tag=study due<2025/01/01 words"')
+    filters.add_argument('--sort', choices=SORT_ORDERS, help='show all tasks in this order')
+    list_.add_argument('--reverse', action='store_true', help='reverse the --sort order')
+    list_.add_argument('--json', action='store_true', help='one JSON task per line')
+    list_.add_argument('--offset', type=int, default=0, help='skip this many tasks first')
+    list_.add_argument('--limit', type=int, help='show at most this many tasks')
+    list_.add_argument('--archived', action='store_true', help='list archived tasks instead')
+    watch_options(list_)
+    list_.set_defaults(handler=cmd_list)
+
+    search = commands.add_parser('search', help='search titles and descriptions')
+    search.add_argument('text')
+    search.add_argument('--limit', type=int, default=SEARCH_LIMIT)
+    search.add_argument('--json', action='store_true', help='one JSON task per line')
+    search.add_argument('--archived', action='store_true', help='search archived tasks instead')
+    search.set_defaults(handler=cmd_search)
+
+    stats = commands.add_parser('stats', help='show the statistics dashboard')
+    stats.add_argument('--internal', action='store_true', help='show timings and counts saved with TASKS_METRICS instead')
+    watch_options(stats)
+    stats.set_defaults(handler=cmd_stats)
+
+    archive_ = commands.add_parser('archive', help='move old done tasks to an archive next to the store')
+    archive_.add_argument('--days', type=int, default=ARCHIVE_DAYS,
+                          help='archive done tasks due more than this many days ago (default: TASKS_ARCHIVE_DAYS or 30)')
+    archive_.set_defaults(handler=cmd_archive)
+
+    export = commands.add_parser('export', help='export tasks to a file (.gz to compress)')
+    export.add_argument('format', choices=list(EXPORT_FORMATS.values()))
+    export.add_argument('path')
+    export.add_argument('--filter', default='', help='a query like list --query')
+    export.set_defaults(handler=cmd_export)
+
+    import_ = commands.add_parser('import', help='import tasks from a .csv or .jsonl file')
+    import_.add_argument('path')
+    import_.set_defaults(handler=cmd_import)
+
+    batch = commands.add_parser('batch', help='run commands from a file, one per line (- for stdin)')
+    batch.add_argument('file', nargs='?', default='-')
+    batch.set_defaults(handler=cmd_batch)
+    generate = commands.add_parser('generate', help='add made up tasks, for trying things out at size')
+    generate.add_argument('count', type=int)
+    generate.add_argument('--seed', type=int, default=0)
+    generate.set_defaults(handler=cmd_generate)
+    bench = commands.add_parser('bench', help='time the main operations on generated tasks')
+    bench.add_argument('--sizes', default='1000,100000', help='task counts separated by commas, e.g. 1000,100000,1000000')
+    bench.add_argument('--backends', default='json,sqlite')
+    bench.add_argument('--repeat', type=int, default=3, help='warm runs per operation')
+    bench.add_argument('--seed', type=int, default=0)
+    bench.add_argument('--out', default='bench.json', help='where to write the results as JSON')
+    bench.set_defaults(handler=cmd_bench)
+    serve = commands.add_parser('serve', help='serve the tasks as a JSON API over HTTP')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8000)
+    serve.set_defaults(handler=cmd_serve)
+    return parser
+
+# --profile cpu: cProfile's 25 most expensive calls, --profile memory: where
+# the memory still in use at the end was allocated and the peak
+PROFILE_LINES = 25
+
+def profiled(handler, args):
+    if args.profile == 'cpu':
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(handler, args)
+        finally:
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(PROFILE_LINES)
+            if args.profile_out:
+                profiler.dump_stats(args.profile_out)
+    else:
+        tracemalloc.start()
+        try:
+            handler(args)
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            print(f'\nMemory in use {current / 2 ** 20:.2f} MB, peak {peak / 2 ** 20:.2f} MB', file=sys.stderr)
+            for stat in snapshot.statistics('lineno')[:PROFILE_LINES]:
+                print(stat, file=sys.stderr)
+
+def run_command(args):
+    global PAUSE
+    PAUSE = 0
+    handler = measured('command ' + args.command, args.handler) if metrics else args.handler
+    try:
+        if args.profile:
+            profiled(handler, args)
+        else:
+            handler(args)
+    except (ValueError, OSError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+    finally:
+        store.close()
+    return 0
+
+def main(argv=None):
+    global store
+    args = build_parser().parse_args(argv)
+    if args.backend:
+        store = open_store(args.backend)
+    if args.command:
+        return run_command(args)
 
-def main():
     all_actions = [add_task, mark_task, delete_task, view_all_tasks, update_task, search_task, 
-    sort_tasks, statistics_screen, export_tasks,  filter_by_priority, filter_by_tag, filter_by_done, guide]
+    sort_tasks, statistics_screen, export_tasks,  filter_by_priority, filter_by_tag, filter_by_done, guide,
+    import_tasks]
+    if metrics:
+        # Screen times include the time spent typing and the pauses
+        all_actions = [measured('screen ' + action.__name__, action) for action in all_actions]
 
+    store.load()
     intro()
     show_all()
 
     while True:
         try:
-            action = int(input('\nEnter (1 - 13): '))
+            action = int(input('\nEnter (1 - 14): '))
 
             if action == 0:
+                store.close()
                 ending()
                 break
 
+            # Show what other sessions changed since the last screen
+            store.refresh()
             all_actions[action - 1]()
             
         except ValueError:
             print('\n❌ Error: Enter an integer!')
         except IndexError:
-            print('\n❌ Error: Enter (1 - 13) or 0 to exit!')
+            print('\n❌ Error: Enter (1 - 14) or 0 to exit!')
             
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
 #⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋⌈⌉⌊⌋
\ No newline at end of file
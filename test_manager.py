@@ -0,0 +1,315 @@
+import os
+from datetime import date, timedelta
+
+import pytest
+
+import manager
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = manager.open_store(request.param)
+    store.add({'id': '1', 'title': 'Buy milk', 'description': '2L', 'priority': 'low',
+               'due date': '2025/01/10', 'done': False, 'tag': 'home'})
+    store.save()
+    yield store
+    store.close()
+
+
+# Another session changed the title after we read version 0
+def changed_title(store):
+    store.update('1', {'title': 'Buy oat milk'}, 0)
+    return 0
+
+
+def test_stale_version_merges_other_field(store):
+    seen = changed_title(store)
+    task = store.update('1', {'priority': 'high'}, seen)
+    assert (task['title'], task['priority'], task['version']) == ('Buy oat milk', 'high', 2)
+
+
+def test_stale_version_same_field_conflicts(store):
+    seen = changed_title(store)
+    with pytest.raises(manager.ConflictError):
+        store.update('1', {'title': 'Buy soy milk'}, seen)
+    assert store.get('1')['title'] == 'Buy oat milk'
+
+
+def test_future_version_is_rejected(store):
+    with pytest.raises(manager.ConflictError):
+        store.update('1', {'title': 'Buy soy milk'}, 99)
+    with pytest.raises(manager.ConflictError):
+        store.delete('1', 99)
+    assert store.get('1')['version'] == 0
+
+
+def task(task_id, **fields):
+    return {'id': task_id, 'title': f'Task {task_id}', 'description': '', 'priority': 'medium',
+            'due date': '2025/01/10', 'done': False, 'tag': '', **fields}
+
+
+def saved_tasks(path):
+    return [dict(t) for t in manager.TaskStore(path).all()]
+
+
+def test_journal_replay_matches_full_save(tmp_path):
+    path = str(tmp_path / 'tasks.json')
+    store = manager.TaskStore(path)
+    store.add_many([task(str(i)) for i in range(1, 6)])
+    store.update('2', {'title': 'Call mom', 'priority': 'high'}, 0)
+    store.mark_done('3')
+    store.delete('4')
+    store.add(task('4', tag='home'))
+    store.save()
+    assert not (tmp_path / 'tasks.json').exists()
+    replayed = saved_tasks(path)
+    assert replayed == [dict(t) for t in store.all()]
+
+    with store.lock:
+        store.compact()
+    assert not (tmp_path / 'tasks.journal').exists()
+    assert saved_tasks(path) == replayed
+
+
+def test_truncated_journal_tail_is_recovered(tmp_path):
+    path = str(tmp_path / 'tasks.json')
+    store = manager.TaskStore(path)
+    store.add_many([task('1'), task('2')])
+    store.close()
+    # A session that crashed halfway through writing an entry
+    with open(tmp_path / 'tasks.journal', 'ab') as f:
+        f.write(b'{"op": "add", "task": {"id": "9", "tit')
+
+    other = manager.TaskStore(path)
+    assert [t['id'] for t in other.all()] == ['1', '2']
+    other.add(task('3'))
+    other.close()
+    assert [t['id'] for t in saved_tasks(path)] == ['1', '2', '3']
+
+
+def test_compaction_with_concurrent_writer(tmp_path, monkeypatch):
+    monkeypatch.setattr(manager, 'COMPACT_EVERY', 3)
+    path = str(tmp_path / 'tasks.json')
+    first, second = manager.TaskStore(path), manager.TaskStore(path)
+    first.add_many([task('1'), task('2')])
+    assert second.get('2')['version'] == 0
+
+    # The third change folds the journal into tasks.json
+    first.update('1', {'title': 'Pay rent'})
+    first.mark_done('2')
+    first.save()
+    assert (tmp_path / 'tasks.json').exists()
+    assert not (tmp_path / 'tasks.journal').exists()
+
+    # The journal second had read is gone, it reads tasks.json again
+    with pytest.raises(manager.ConflictError):
+        second.update('2', {'done': False}, 0)
+    assert second.get('1')['title'] == 'Pay rent'
+    second.update('2', {'title': 'Buy bread'}, second.get('2')['version'])
+    second.add(task('3'))
+    second.save()
+
+    assert first.refresh() == ['2', '3']
+    assert first.get('2')['title'] == 'Buy bread' and first.get('2')['done']
+    assert saved_tasks(path) == [dict(t) for t in first.all()]
+    first.close()
+    second.close()
+
+
+@pytest.fixture(params=['json', 'sqlite', 'shards'])
+def generated(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = manager.open_store(request.param)
+    manager.add_generated(store, 3000, seed=14)
+    # Changes after the indexes are built have to reach them too
+    tasks = store.all()
+    for task in tasks[:50]:
+        store.update(task['id'], {'priority': 'high', 'tag': 'work,urgent'})
+    store.delete_many([task['id'] for task in tasks[50:80]])
+    yield store
+    store.close()
+
+
+def day(offset):
+    return (date.today() + timedelta(days=offset)).strftime('%Y/%m/%d')
+
+
+QUERIES = [
+    'tag=work',
+    'tag=home,study tag=urgent',
+    'tag!=work tag:fam',
+    f'due>={day(0)} due<{day(7)}',
+    f'due>{day(-30)} due<={day(30)} done=false',
+    'invoice',
+    'budget meeting',
+    'priority=high',
+    'priority!=low title:report',
+    f'priority=medium due<{day(14)}',
+    f'priority=high due>={day(0)} due<{day(60)} tag=work done=false',
+    f'tag=study due<{day(90)} exam',
+]
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_find_matches_checking_every_task(generated, query):
+    conditions = manager.parse_query(query)
+    tasks = [manager.Task(dict(t)) for t in generated.all()]
+    expected = {t['id'] for t in manager.scan_tasks(tasks, conditions)}
+    assert expected
+    assert {t['id'] for t in generated.find(conditions)} == expected
+
+
+@pytest.fixture
+def snapshot(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(manager, 'COMPACT_EVERY', 10 ** 9)
+    store = manager.TaskStore()
+    manager.add_generated(store, 500, seed=25)
+    store.compact()
+    store.close()
+    monkeypatch.setattr(manager, 'SNAPSHOT', True)
+    # The first load writes the snapshot, the next ones read it
+    manager.TaskStore().ensure_loaded()
+    assert (tmp_path / 'tasks.snapshot').exists()
+    return monkeypatch
+
+
+# What the screens show: list, sorts, dashboard counts and searches
+def view(store):
+    stats = store.stats()
+    shown = [[dict(t) for t in store.iter_tasks()], (stats.total, stats.done, dict(+stats.priorities)),
+             store.due_counts(), dict(store.tag_counts())]
+    for order in manager.SORT_ORDERS:
+        shown += [[t.id for t in store.sorted_tasks(order, reverse)] for reverse in (False, True)]
+    for query in ['priority=high done=false', 'tag=work', 'title:re', 'invoice', 'Added', 'id=7']:
+        shown.append(sorted(t.id for t in store.find(manager.parse_query(query))))
+    return shown
+
+
+def snapshot_view(monkeypatch):
+    store = manager.TaskStore()
+    store.ensure_loaded()
+    assert isinstance(store.tasks, manager.SnapshotTasks)
+    shown = view(store)
+    monkeypatch.setattr(manager, 'SNAPSHOT', False)
+    assert shown == view(manager.TaskStore())
+    monkeypatch.setattr(manager, 'SNAPSHOT', True)
+    return store
+
+
+def test_snapshot_with_journal_matches_json(snapshot):
+    # Another session's changes, only in the journal
+    other = manager.TaskStore()
+    for i, changed in enumerate(list(other.iter_tasks())[:120]):
+        if i % 4 == 0:
+            other.update(changed.id, {'title': 'Aaa invoice', 'tag': 'work, new', 'priority': 'high',
+                                   'due date': '2020/01/01'})
+        elif i % 4 == 1:
+            other.mark_done(changed.id)
+        elif i % 4 == 2:
+            other.delete(changed.id)
+        else:
+            other.add(task(other.new_id(), title='Added here', priority='low', tag='work'))
+    other.close()
+    assert os.path.exists('tasks.journal')
+
+    store = snapshot_view(snapshot)
+    # And changes made on top of the snapshot in this session
+    first = next(store.iter_tasks())
+    store.update(first.id, {'title': 'Zzz last'})
+    store.delete(next(store.sorted_tasks('due')).id)
+    store.add(task(store.new_id(), title='Added again'))
+    store.close()
+    snapshot_view(snapshot)
+
+
+# A crash while copying it, or a disk error
+def truncate_snapshot(path):
+    os.truncate(path, os.path.getsize(path) // 2)
+
+
+def overwrite_snapshot(path):
+    with open(path, 'r+b') as f:
+        f.seek(os.path.getsize(path) // 3)
+        f.write(b'\xff' * 64)
+        f.seek(0)
+        f.write(b'garbage!')
+
+
+@pytest.mark.parametrize('damage', [truncate_snapshot, overwrite_snapshot])
+def test_damaged_snapshot_is_rebuilt(snapshot, damage):
+    damage('tasks.snapshot')
+    store = manager.TaskStore()
+    store.ensure_loaded()
+    assert not isinstance(store.tasks, manager.SnapshotTasks)
+    assert manager.open_snapshot('tasks.snapshot', manager.file_state('tasks.json'))
+    snapshot_view(snapshot)
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = manager.open_store('shards')
+    yield store
+    store.close()
+
+
+def month_files():
+    return sorted(name for name in os.listdir('tasks') if manager.SHARD_FILE.match(name))
+
+
+def test_task_goes_to_its_month(shards):
+    shards.add(task('1', **{'due date': '2025/01/31'}))
+    shards.add(task('2', **{'due date': '2025/02/01'}))
+    assert month_files() == ['2025-01.journal', '2025-02.journal']
+    assert shards.month_map.read() == {'1': '2025-01', '2': '2025-02'}
+    assert [t.id for t in shards.shards['2025-02'].all()] == ['2']
+
+
+def test_due_change_moves_task_to_other_month(shards):
+    shards.add(task('1', **{'due date': '2025/01/10'}))
+    shards.update('1', {'due date': '2025/03/02', 'title': 'Moved'}, 0)
+    assert '1' not in shards.shards['2025-01']
+    other = manager.open_store('shards')
+    assert other.shard_of('1') is other.shards['2025-03']
+    assert other.get('1')['title'] == 'Moved'
+    assert [t.id for t in other.all()] == ['1']
+
+
+def test_ids_stay_unique_across_months(shards):
+    first = shards.add(task('1', **{'due date': '2025/01/10'}))
+    second = shards.add(task('1', **{'due date': '2025/02/10'}))
+    # Another session doesn't know about either yet
+    third = manager.open_store('shards').add(task('1', **{'due date': '2025/03/10'}))
+    shards.refresh()
+    ids = [first.id, second.id, third.id] + shards.new_ids(2)
+    assert len(set(ids)) == len(ids)
+    assert sorted(t.id for t in shards.all()) == sorted(ids[:3])
+
+
+def loaded_months(store):
+    return {key for key, shard in store.shards.items() if shard.loaded}
+
+
+def test_dashboard_and_tag_filter_load_only_their_months(shards, monkeypatch, capsys):
+    manager.add_generated(shards, 2000, seed=21)
+    rare = [shards.shards[key].all()[0] for key in shards.keys()[:2]]
+    for rare_task in rare:
+        shards.update(rare_task.id, {'tag': 'rare'})
+    shards.close()
+    assert len(shards.keys()) > 5
+
+    store = manager.open_store('shards')
+    monkeypatch.setattr(manager, 'store', store)
+    manager.get_task_dues()
+    today = date.today()
+    months = {today.strftime('%Y-%m'), (today + timedelta(days=30)).strftime('%Y-%m')}
+    assert today.strftime('%Y-%m') in loaded_months(store)
+    assert loaded_months(store) <= months
+    assert 'OverDue' in capsys.readouterr().out
+
+    store = manager.open_store('shards')
+    found = list(store.find(manager.parse_query('tag=rare')))
+    assert sorted(t.id for t in found) == sorted(t.id for t in rare)
+    assert loaded_months(store) == set(shards.keys()[:2])
\ No newline at end of file